@@ -0,0 +1,203 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlparse
+import pymupdf
+
+WORDS = ['payment', 'checkout', 'user', 'latency', 'release', 'api', 'report', 'export', 'admin', 'search',
+         'invoice', 'mobile', 'sync', 'account', 'limit', 'review', 'rollout', 'metric', 'alert', 'billing']
+
+
+def sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+BOILERPLATE = [
+    'Confidentiality notice: this document contains proprietary product plans intended for internal review only. '
+    'Do not forward, copy or share it outside the product, engineering and legal teams without written approval '
+    'from the document owner and the responsible product director.',
+    'Definitions: a user is any person with an active account, an administrator is a user with billing rights, and '
+    'a release is any build promoted to production after passing review, rollout checks and the standard metric '
+    'alert thresholds agreed with the operations team.'
+]
+
+
+def make_storage_body(rng, sections=6, table_rows=10, links=(), attachments=(), boilerplate=0):
+    parts = [f'<h2>Notice {n}</h2><p>{BOILERPLATE[n % len(BOILERPLATE)]}</p>' for n in range(boilerplate)]
+    for s in range(sections):
+        parts.append(f'<h2>Section {s}</h2>')
+        parts.append(f'<p>{sentence(rng, 30)} <strong>{sentence(rng, 5)}</strong> &amp; {sentence(rng)}&nbsp;</p>')
+        parts.append('<ac:structured-macro ac:name="info"><ac:rich-text-body>'
+                     f'<p>{sentence(rng)}</p></ac:rich-text-body></ac:structured-macro>')
+        parts.append('<table><tbody>')
+        for r in range(table_rows):
+            parts.append(f'<tr><td>{r}</td><td>{sentence(rng, 6)}</td><td> </td><td>{rng.random():.3f}</td></tr>')
+        parts.append('</tbody></table>')
+        parts.append('<ac:structured-macro ac:name="code"><ac:plain-text-body>'
+                     f'<![CDATA[def f():\n    return {s}]]></ac:plain-text-body></ac:structured-macro>')
+    for space, title in links:
+        parts.append(f'<p><ac:link><ri:page ri:content-title="{title}" ri:space-key="{space}" /></ac:link></p>')
+    for filename in attachments:
+        parts.append(f'<ac:image><ri:attachment ri:filename="{filename}" /></ac:image>')
+    return '\n'.join(parts)
+
+
+def make_pdf(rng, pages=2, lines=40):
+    with pymupdf.open() as doc:
+        for _ in range(pages):
+            page = doc.new_page()
+            page.insert_text((50, 60), '\n'.join(sentence(rng, 10) for _ in range(lines)), fontsize=9)
+        return doc.tobytes()
+
+
+class FakeConfluenceServer:
+    def __init__(self, host='127.0.0.1', port=0, space='BENCH', root_title='Product Documentation', depth=2,
+                 fanout=4, sections=6, table_rows=10, links_per_page=2, pdfs_per_page=1, pdf_pages=2,
+                 boilerplate=0, latency=0.0, seed=0):
+        self.space = space
+        self.root_title = root_title
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.pages = {}
+        self.children = {}
+        self.attachments = {}
+        self.pdfs = {}
+        self._build(depth, fanout, sections, table_rows, links_per_page, pdfs_per_page, pdf_pages, boilerplate, seed)
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def roots(self):
+        return [(self.space, self.root_title)]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='fake-confluence', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _build(self, depth, fanout, sections, table_rows, links_per_page, pdfs_per_page, pdf_pages, boilerplate,
+               seed):
+        rng = random.Random(seed)
+        titles = {}
+        level = [(None, self.root_title)]
+        next_id = 1000
+        for d in range(depth + 1):
+            next_level = []
+            for parent_id, title in level:
+                page_id = str(next_id)
+                next_id += 1
+                titles[page_id] = title
+                self.children.setdefault(page_id, [])
+                if parent_id:
+                    self.children[parent_id].append(page_id)
+                if d < depth:
+                    next_level.extend((page_id, f'{title} {n}' if parent_id else f'Area {n}') for n in range(fanout))
+            level = next_level
+
+        page_titles = list(titles.values())
+        for page_id, title in titles.items():
+            filenames = [f'Spec-{page_id}-{n}.pdf' for n in range(pdfs_per_page)]
+            links = [(self.space, rng.choice(page_titles)) for _ in range(links_per_page)]
+            body = make_storage_body(rng, sections, table_rows, links, [name.upper() for name in filenames],
+                                     boilerplate=boilerplate)
+            self.pages[page_id] = {
+                'id': page_id,
+                'type': 'page',
+                'status': 'current',
+                'title': title,
+                'space': {'key': self.space},
+                'version': {'number': 1, 'when': '2024-05-01T10:00:00.000Z'},
+                'history': {'createdDate': '2024-01-15T09:30:00.000Z'},
+                'body': {'storage': {'value': body, 'representation': 'storage'}}
+            }
+            self.attachments[page_id] = []
+            for filename in filenames:
+                data = make_pdf(rng, pages=pdf_pages)
+                self.pdfs[(page_id, filename)] = data
+                self.attachments[page_id].append({
+                    'id': f'att{page_id}{filename}',
+                    'type': 'attachment',
+                    'title': filename,
+                    'version': {'number': 1},
+                    'extensions': {'fileSize': len(data), 'mediaType': 'application/pdf'},
+                    '_links': {'download': f'/download/attachments/{page_id}/{filename}'}
+                })
+
+    def handle(self, path, query):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        parts = [unquote(part) for part in path.strip('/').split('/')]
+        if parts[:3] == ['rest', 'api', 'content']:
+            if len(parts) == 3:
+                title = query.get('title', [''])[0]
+                space = query.get('spaceKey', [''])[0]
+                results = [page for page in self.pages.values()
+                           if page['title'] == title and (not space or space == self.space)]
+                return 200, {'results': results[:1], 'size': len(results[:1])}
+            page_id = parts[3]
+            if page_id not in self.pages:
+                return 404, {'message': f'No content found with id {page_id}'}
+            if len(parts) == 4:
+                return 200, self.pages[page_id]
+            if parts[4:] == ['child', 'page']:
+                items = [self.pages[child] for child in self.children[page_id]]
+            elif parts[4:] == ['child', 'attachment']:
+                items = self.attachments[page_id]
+            else:
+                return 404, {'message': 'Unknown resource'}
+            start = int(query.get('start', ['0'])[0])
+            limit = int(query.get('limit', ['25'])[0])
+            results = items[start:start + limit]
+            return 200, {'results': results, 'start': start, 'limit': limit, 'size': len(results)}
+        if parts[:2] == ['download', 'attachments'] and len(parts) == 4:
+            data = self.pdfs.get((parts[2], parts[3]))
+            if data is None:
+                return 404, {'message': 'Attachment not found'}
+            return 200, data
+        return 404, {'message': f'Unknown path {path}'}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                status, data = server.handle(url.path, parse_qs(url.query))
+                if isinstance(data, bytes):
+                    body, content_type = data, 'application/pdf'
+                else:
+                    body, content_type = json.dumps(data).encode('utf-8'), 'application/json'
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
@@ -0,0 +1,171 @@
+from datetime import datetime, timezone
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+import numpy as np
+
+WORDS = ['overview', 'scope', 'requirement', 'user', 'story', 'acceptance', 'criteria', 'the', 'system', 'shall',
+         'support', 'export', 'of', 'reports', 'and', 'alerts', 'for', 'admins', 'within', 'seconds']
+
+
+class FakeOllamaServer:
+    def __init__(self, host='127.0.0.1', port=0, dim=768, embed_latency=0.0, embed_item_latency=0.0,
+                 chat_ttft=0.0, chat_token_latency=0.0, chat_tokens=200, parallel=1):
+        self.dim = dim
+        self.embed_latency = embed_latency
+        self.embed_item_latency = embed_item_latency
+        self.chat_ttft = chat_ttft
+        self.chat_token_latency = chat_token_latency
+        self.chat_tokens = chat_tokens
+        self.slots = threading.BoundedSemaphore(max(1, parallel))
+        self.requests = {'embed': 0, 'chat': 0, 'embedded_texts': 0}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='fake-ollama', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.requests[name] += amount
+
+    def embedding(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dim)
+        return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+    def embed(self, payload):
+        texts = payload.get('input') or []
+        if isinstance(texts, str):
+            texts = [texts]
+        self.count('embed')
+        self.count('embedded_texts', len(texts))
+        with self.slots:
+            time.sleep(self.embed_latency + self.embed_item_latency * len(texts))
+        return {
+            'model': payload.get('model'),
+            'embeddings': [self.embedding(text) for text in texts],
+            'prompt_eval_count': sum(len(text.split()) for text in texts)
+        }
+
+    def chat_tokens_for(self, prompt):
+        seed = int.from_bytes(hashlib.sha256(prompt.encode('utf-8')).digest()[:8], 'little')
+        rng = np.random.default_rng(seed)
+        tokens = ['# Generated PRD\n\n## Overview\n']
+        for n in range(self.chat_tokens - 1):
+            word = WORDS[rng.integers(len(WORDS))]
+            tokens.append(f'{word}\n\n## Section {n}\n' if n % 40 == 39 else f'{word} ')
+        return tokens
+
+    def chat_part(self, payload, content, done, prompt_tokens=0, eval_count=0, started=0.0):
+        part = {
+            'model': payload.get('model'),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'message': {'role': 'assistant', 'content': content},
+            'done': done
+        }
+        if done:
+            elapsed = int((time.perf_counter() - started) * 1e9)
+            part.update({
+                'done_reason': 'stop',
+                'total_duration': elapsed,
+                'prompt_eval_count': prompt_tokens,
+                'prompt_eval_duration': int(self.chat_ttft * 1e9),
+                'eval_count': eval_count,
+                'eval_duration': max(0, elapsed - int(self.chat_ttft * 1e9))
+            })
+        return part
+
+    def chat(self, payload, write_line=None):
+        prompt = ''.join(message.get('content', '') for message in payload.get('messages', []))
+        prompt_tokens = len(prompt) // 4
+        tokens = self.chat_tokens_for(prompt)
+        num_predict = (payload.get('options') or {}).get('num_predict')
+        if num_predict and num_predict > 0:
+            tokens = tokens[:num_predict]
+        self.count('chat')
+        with self.slots:
+            started = time.perf_counter()
+            time.sleep(self.chat_ttft)
+            if write_line is None:
+                time.sleep(self.chat_token_latency * len(tokens))
+                return self.chat_part(payload, ''.join(tokens), True, prompt_tokens, len(tokens), started)
+            for token in tokens:
+                write_line(self.chat_part(payload, token, False))
+                time.sleep(self.chat_token_latency)
+            write_line(self.chat_part(payload, '', True, prompt_tokens, len(tokens), started))
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.startswith('/api/version'):
+                    self.send_json({'version': '0.0.0-bench'})
+                elif self.path.startswith('/api/ps'):
+                    self.send_json({'models': []})
+                else:
+                    self.send_json({'error': f'unknown path {self.path}'}, status=404)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                if self.path.startswith('/api/embed'):
+                    self.send_json(server.embed(payload))
+                elif self.path.startswith('/api/chat'):
+                    if payload.get('stream', True) is False:
+                        self.send_json(server.chat(payload))
+                    else:
+                        self.send_stream(payload)
+                else:
+                    self.send_json({'error': f'unknown path {self.path}'}, status=404)
+
+            def send_json(self, data, status=200):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_stream(self, payload):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                def write_line(part):
+                    line = json.dumps(part).encode('utf-8') + b'\n'
+                    self.wfile.write(f'{len(line):x}\r\n'.encode('ascii') + line + b'\r\n')
+                    self.wfile.flush()
+
+                server.chat(payload, write_line=write_line)
+                self.wfile.write(b'0\r\n\r\n')
+
+        return Handler
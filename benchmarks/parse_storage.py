@@ -0,0 +1,56 @@
+import argparse
+import json
+import random
+import time
+from benchmarks.fake_confluence import make_storage_body
+from ingestion.utils.confluence_utils import parse_confluence_page, parse_confluence_page_soup
+
+
+def make_storage_page(sections=20, table_rows=40, seed=0):
+    rng = random.Random(seed)
+    links = [('CAR', f'Page {s}') for s in range(sections)]
+    attachments = [f'Spec-{s}.PDF' for s in range(sections)]
+    return make_storage_body(rng, sections, table_rows, links, attachments)
+
+
+def time_parser(parse, pages, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for body in pages:
+            parse(body)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def run(pages=20, sections=20, table_rows=40, repeat=3):
+    bodies = [make_storage_page(sections, table_rows, seed=n) for n in range(pages)]
+    for body in bodies:
+        if parse_confluence_page(body) != parse_confluence_page_soup(body):
+            raise AssertionError('Single-pass extractor output differs from the BeautifulSoup path')
+
+    total_bytes = sum(len(body.encode('utf-8')) for body in bodies)
+    soup_seconds = time_parser(parse_confluence_page_soup, bodies, repeat)
+    single_seconds = time_parser(parse_confluence_page, bodies, repeat)
+    return {
+        'pages': pages,
+        'megabytes': round(total_bytes / 1e6, 2),
+        'soup_pages_per_sec': round(pages / soup_seconds, 1),
+        'single_pass_pages_per_sec': round(pages / single_seconds, 1),
+        'speedup': round(soup_seconds / single_seconds, 2)
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark Confluence storage format parsing.')
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--sections', type=int, default=20)
+    parser.add_argument('--table-rows', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=3)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = run(args.pages, args.sections, args.table_rows, args.repeat)
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,340 @@
+import argparse
+from datetime import datetime, timezone
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.fake_confluence import FakeConfluenceServer, sentence
+from benchmarks.fake_ollama import FakeOllamaServer
+
+logger = logging.getLogger(__name__)
+
+REPO_MODULES = ('utils.', 'ingestion.', 'generation.')
+
+
+def serve(server_class, kwargs, ready):
+    server = server_class(**kwargs)
+    ready.put(server.url)
+    server.httpd.serve_forever()
+
+
+def start_server_process(server_class, **kwargs):
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(server_class, kwargs, ready),
+                                      name=server_class.__name__, daemon=True)
+    process.start()
+    return process, ready.get(timeout=120)
+
+
+def configure_environment(workdir, ollama_url, confluence_url, embedding_cache=False, ollama_parallel=1):
+    loaded = [name for name in sys.modules if name.startswith(REPO_MODULES)]
+    if loaded:
+        raise RuntimeError(f'Repo modules imported before the benchmark environment was set up: {loaded}')
+
+    paths = {name: os.path.join(workdir, name) for name in ('chroma', 'downloads', 'generated')}
+    for path in paths.values():
+        os.makedirs(path, exist_ok=True)
+    os.environ.update({
+        'OLLAMA_HOST': ollama_url,
+        'CONFLUENCE_BASE_URL': confluence_url,
+        'CONFLUENCE_USERNAME': 'bench',
+        'CONFLUENCE_API_KEY': 'bench',
+        'CONFLUENCE_RATE_LIMIT': '0',
+        'DOWNLOADS_BASE_URL': paths['downloads'],
+        'VECTOR_DB_DIRECTORY': paths['chroma'],
+        'SYNC_MANIFEST_PATH': os.path.join(workdir, 'sync_manifest.json'),
+        'EMBEDDING_CACHE_ENABLED': 'true' if embedding_cache else 'false',
+        'EMBEDDING_CACHE_PATH': os.path.join(workdir, 'embedding_cache.sqlite3'),
+        'GENERATED_PRD_PATH': paths['generated'],
+        'OLLAMA_NUM_PARALLEL': str(ollama_parallel),
+        'ANONYMIZED_TELEMETRY': 'False'
+    })
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def latency_summary(latencies):
+    from utils.pipeline_utils import percentile
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'mean_seconds': sum(latencies) / len(latencies) if latencies else 0.0,
+        'p50_seconds': percentile(latencies, 50),
+        'p99_seconds': percentile(latencies, 99)
+    }
+
+
+def merge_stages(stages, elapsed):
+    merged = {}
+    for stage in stages:
+        entry = merged.setdefault(stage.name, {'items_in': 0, 'items_out': 0, 'errors': 0, 'busy_seconds': 0.0,
+                                               'workers': stage.workers, 'latencies': []})
+        entry['items_in'] += stage.items_in
+        entry['items_out'] += stage.items_out
+        entry['errors'] += stage.errors
+        entry['busy_seconds'] += stage.busy_time
+        entry['latencies'].extend(stage.latencies)
+    for entry in merged.values():
+        latencies = latency_summary(entry.pop('latencies'))
+        entry['items_per_sec'] = entry['items_in'] / elapsed if elapsed > 0 else 0.0
+        entry['p50_seconds'] = latencies['p50_seconds']
+        entry['p99_seconds'] = latencies['p99_seconds']
+    return merged
+
+
+def make_brd(seed, paragraphs=6):
+    rng = random.Random(seed)
+    parts = [f'# Business Requirements {seed}']
+    for n in range(paragraphs):
+        parts.append(f'## Need {n}')
+        parts.append(' '.join(sentence(rng, rng.randint(8, 20)) for _ in range(rng.randint(2, 6))))
+    return '\n\n'.join(parts)
+
+
+def bench_parse(args):
+    from benchmarks.parse_storage import run
+    return run(pages=args.parse_pages, repeat=args.repeat)
+
+
+def bench_chunk(args):
+    from benchmarks.fake_confluence import make_storage_body
+    from ingestion.utils.confluence_utils import parse_confluence_page
+    from utils.text_utils import CHUNK_LENGTH_UNIT, CHUNK_MAX_LENGTH, CHUNK_OVERLAP, chunk_text
+
+    rng = random.Random(0)
+    texts = [parse_confluence_page(make_storage_body(rng, sections=20, table_rows=40)).get('text', '')
+             for _ in range(args.chunk_docs)]
+    total_chars = sum(len(text) for text in texts)
+    latencies = []
+    chunks = 0
+    started = time.perf_counter()
+    for text in texts:
+        doc_started = time.perf_counter()
+        chunks += len(chunk_text(text, max_length=CHUNK_MAX_LENGTH, overlap=CHUNK_OVERLAP, length=CHUNK_LENGTH_UNIT))
+        latencies.append(time.perf_counter() - doc_started)
+    elapsed = time.perf_counter() - started
+    return {
+        'docs': len(texts),
+        'megabytes': round(total_chars / 1e6, 2),
+        'chunks': chunks,
+        'seconds': elapsed,
+        'docs_per_sec': len(texts) / elapsed,
+        'chunks_per_sec': chunks / elapsed,
+        'per_doc': latency_summary(latencies)
+    }
+
+
+def bench_ingest(args, roots):
+    from ingestion import confluence
+    from ingestion.utils import confluence_utils
+    from utils.db_utils import get_collection
+
+    results = {}
+    for run_name in ('initial', 'resync'):
+        confluence_utils._title_cache.clear()
+        confluence_utils.get_attachments.cache_clear()
+        started = time.perf_counter()
+        stages = confluence.fetch_and_store_historical_docs(roots)
+        elapsed = time.perf_counter() - started
+        merged = merge_stages(stages, elapsed)
+        docs = merged.get('parse', {}).get('items_in', 0)
+        chunks = merged.get('write', {}).get('items_in', 0)
+        results[run_name] = {
+            'seconds': elapsed,
+            'docs': docs,
+            'chunks': chunks,
+            'docs_per_sec': docs / elapsed if elapsed > 0 else 0.0,
+            'chunks_per_sec': chunks / elapsed if elapsed > 0 else 0.0,
+            'stages': merged,
+            'peak_rss_mb': peak_rss_mb()
+        }
+    results['collection_count'] = get_collection().count()
+    return results
+
+
+def bench_retrieval(args):
+    from generation.utils import retrieve_context
+
+    latencies = []
+    for n in range(args.queries):
+        started = time.perf_counter()
+        retrieve_context(make_brd(n))
+        latencies.append(time.perf_counter() - started)
+    return {'queries': args.queries, 'latency': latency_summary(latencies)}
+
+
+def bench_generation(args):
+    from generation.utils import process_input_text
+
+    latencies = []
+    for n in range(args.generations):
+        started = time.perf_counter()
+        process_input_text(make_brd(1000 + n), stream=args.stream, output_name=f'bench_{n}', sectioned=args.sections)
+        latencies.append(time.perf_counter() - started)
+    return {'generations': args.generations, 'stream': args.stream, 'sections': args.sections,
+            'end_to_end': latency_summary(latencies)}
+
+
+def run_benchmark(name, fn, *args):
+    logger.info(f'Running {name} benchmark')
+    started = time.perf_counter()
+    try:
+        result = fn(*args)
+    except Exception as e:
+        logger.exception(f'{name} benchmark failed: {e}')
+        result = {'error': f'{type(e).__name__}: {e}'}
+    result['wall_seconds'] = time.perf_counter() - started
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{path}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(baseline, current):
+    before = flatten(baseline.get('benchmarks', {}))
+    after = flatten(current.get('benchmarks', {}))
+    comparison = {}
+    for path, value in after.items():
+        if path in before:
+            old = before[path]
+            comparison[path] = {
+                'baseline': old,
+                'current': value,
+                'change': (value - old) / old if old else None
+            }
+    return comparison
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='prd-bench-')
+    servers = []
+    try:
+        ollama, ollama_url = start_server_process(
+            FakeOllamaServer, dim=args.dim, embed_latency=args.embed_latency / 1000,
+            embed_item_latency=args.embed_item_latency / 1000, chat_ttft=args.chat_ttft / 1000,
+            chat_token_latency=args.chat_token_latency / 1000, chat_tokens=args.chat_tokens,
+            parallel=args.ollama_parallel)
+        servers.append(ollama)
+        confluence, confluence_url = start_server_process(
+            FakeConfluenceServer, space=args.space, root_title=args.root_title, depth=args.depth,
+            fanout=args.fanout, pdfs_per_page=args.pdfs_per_page, boilerplate=args.boilerplate,
+            latency=args.confluence_latency / 1000)
+        servers.append(confluence)
+        configure_environment(workdir, ollama_url, confluence_url, embedding_cache=args.embedding_cache,
+                              ollama_parallel=args.ollama_parallel)
+
+        benchmarks = {}
+        selected = set(args.only or BENCHMARKS)
+        if 'parse' in selected:
+            benchmarks['parse'] = run_benchmark('parse', bench_parse, args)
+        if 'chunk' in selected:
+            benchmarks['chunk'] = run_benchmark('chunk', bench_chunk, args)
+        if 'ingest' in selected:
+            benchmarks['ingest'] = run_benchmark('ingest', bench_ingest, args, [(args.space, args.root_title)])
+        if 'retrieval' in selected:
+            benchmarks['retrieval'] = run_benchmark('retrieval', bench_retrieval, args)
+        if 'generation' in selected:
+            benchmarks['generation'] = run_benchmark('generation', bench_generation, args)
+
+        return {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'config': vars(args),
+            'benchmarks': benchmarks,
+            'peak_rss_mb': peak_rss_mb()
+        }
+    finally:
+        for process in servers:
+            process.terminate()
+            process.join(timeout=10)
+        if args.keep_workdir:
+            logger.info(f'Benchmark files kept in {workdir}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+BENCHMARKS = ('parse', 'chunk', 'ingest', 'retrieval', 'generation')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark ingestion and generation against local stand-ins.')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help='Run only these benchmarks')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    parser.add_argument('--baseline', help='Previous results JSON to compare against')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--parse-pages', type=int, default=20)
+    parser.add_argument('--chunk-docs', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--generations', type=int, default=5)
+    parser.add_argument('--stream', action='store_true', help='Stream generation responses')
+    parser.add_argument('--sections', action='store_true', help='Generate PRD sections concurrently from an outline')
+    parser.add_argument('--space', default='BENCH')
+    parser.add_argument('--root-title', default='Product Documentation')
+    parser.add_argument('--depth', type=int, default=2, help='Depth of the synthetic Confluence page tree')
+    parser.add_argument('--fanout', type=int, default=4, help='Child pages per page in the synthetic tree')
+    parser.add_argument('--pdfs-per-page', type=int, default=1)
+    parser.add_argument('--boilerplate', type=int, default=0,
+                        help='Shared notice paragraphs repeated on every synthetic page')
+    parser.add_argument('--confluence-latency', type=float, default=5.0, help='Milliseconds per Confluence request')
+    parser.add_argument('--dim', type=int, default=768, help='Embedding dimension')
+    parser.add_argument('--embed-latency', type=float, default=5.0, help='Milliseconds per embed request')
+    parser.add_argument('--embed-item-latency', type=float, default=1.0, help='Extra milliseconds per embedded text')
+    parser.add_argument('--chat-ttft', type=float, default=200.0, help='Milliseconds before the first token')
+    parser.add_argument('--chat-token-latency', type=float, default=2.0, help='Milliseconds per generated token')
+    parser.add_argument('--chat-tokens', type=int, default=300)
+    parser.add_argument('--ollama-parallel', type=int, default=1, help='Concurrent requests the fake Ollama serves')
+    parser.add_argument('--embedding-cache', action='store_true', help='Keep the embedding cache enabled')
+    parser.add_argument('--keep-workdir', action='store_true')
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        stream=sys.stderr
+    )
+    logger.setLevel(logging.INFO)
+    results = run(args)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            results['comparison'] = compare(json.load(f), results)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+        logger.info(f'Wrote benchmark results to {args.output}')
+    else:
+        print(output)
@@ -1,7 +1,8 @@
+import argparse
 from dotenv import load_dotenv
 import logging
 import os
-from generation.utils import process_input_text
+from generation.utils import BATCH_RETRIEVAL_WORKERS, OLLAMA_NUM_PARALLEL, SECTIONED_GENERATION, STREAM_GENERATION, process_input_files, process_input_text
 from ingestion.utils.docx_utils import extract_text_from_docx
 
 logging.basicConfig(
@@ -15,20 +16,58 @@ load_dotenv()
 BRD_PATH = os.getenv('BRD_LOC')
 
 
-def process_input():
+def list_input_files():
+    return sorted(f for f in os.listdir(BRD_PATH) if not f.startswith('.') and os.path.isfile(os.path.join(BRD_PATH, f)))
+
+
+def process_input(stream=STREAM_GENERATION, sectioned=SECTIONED_GENERATION):
     try:
-        files = [f for f in os.listdir(BRD_PATH) if not f.startswith('.') and os.path.isfile(os.path.join(BRD_PATH, f))]
+        files = list_input_files()
         file = files[0]
         file_path = f'{BRD_PATH}/{file}'
         text = extract_text_from_docx(file_path)
-        process_input_text(text)
+        process_input_text(text, stream=stream, sectioned=sectioned)
         logger.info('PRD generated Successfully')
     except Exception as e:
         logger.exception(f'Error while processing input : {str(e)}')
-    
+
+
+
+def process_batch(stream=STREAM_GENERATION, retrieval_workers=BATCH_RETRIEVAL_WORKERS, llm_parallel=OLLAMA_NUM_PARALLEL,
+                  sectioned=SECTIONED_GENERATION):
+    file_paths = []
+    for f in list_input_files():
+        if not f.lower().endswith('docx'):
+            logger.warning(f'File {f} is not a .docx file')
+            continue
+        file_paths.append(os.path.join(BRD_PATH, f))
+    logger.info(f'Generating PRDs for {len(file_paths)} BRDs')
+    return process_input_files(file_paths, stream=stream, retrieval_workers=retrieval_workers, llm_parallel=llm_parallel,
+                               sectioned=sectioned)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Generate a PRD from the BRD in BRD_LOC')
+    parser.add_argument('--stream', action='store_true', default=STREAM_GENERATION,
+                        help='Stream tokens to prd.md as they are generated')
+    parser.add_argument('--batch', action='store_true',
+                        help='Generate one PRD per BRD in BRD_LOC instead of only the first')
+    parser.add_argument('--retrieval-workers', type=int, default=BATCH_RETRIEVAL_WORKERS,
+                        help='Worker threads for BRD parsing, embedding and retrieval in batch mode')
+    parser.add_argument('--llm-parallel', type=int, default=OLLAMA_NUM_PARALLEL,
+                        help='Concurrent generation requests, match the Ollama server OLLAMA_NUM_PARALLEL')
+    parser.add_argument('--sections', action='store_true', default=SECTIONED_GENERATION,
+                        help='Write an outline first, then generate each PRD section concurrently with its own context')
+    return parser.parse_args()
+
 
 if __name__ == '__main__':
+    args = parse_args()
     try:
-        process_input()
+        if args.batch:
+            process_batch(stream=args.stream, retrieval_workers=args.retrieval_workers, llm_parallel=args.llm_parallel,
+                          sectioned=args.sections)
+        else:
+            process_input(stream=args.stream, sectioned=args.sections)
     except KeyboardInterrupt:
         logger.exception('Keyboard Interrupt')
\ No newline at end of file
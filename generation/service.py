@@ -0,0 +1,263 @@
+import argparse
+from collections import deque
+from concurrent.futures import Future
+from dotenv import load_dotenv
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from generation.utils import OLLAMA_NUM_PARALLEL, SECTIONED_GENERATION, STREAM_GENERATION, generate_and_write_prd, get_output_name, retrieve_context
+from ingestion.utils.docx_utils import extract_text_from_docx
+from utils.db_utils import get_collection
+from utils.lexical_utils import get_lexical_index
+from utils.ollama_utils import parse_keep_alive, preload_models, set_chat_parallelism, set_keep_alive
+from utils.pipeline_utils import percentile
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+PRD_SERVICE_HOST = os.getenv('PRD_SERVICE_HOST', '127.0.0.1')
+PRD_SERVICE_PORT = int(os.getenv('PRD_SERVICE_PORT', 8765))
+PRD_SERVICE_WORKERS = int(os.getenv('PRD_SERVICE_WORKERS', OLLAMA_NUM_PARALLEL))
+PRD_SERVICE_QUEUE_SIZE = int(os.getenv('PRD_SERVICE_QUEUE_SIZE', 16))
+PRD_SERVICE_KEEP_ALIVE = parse_keep_alive(os.getenv('OLLAMA_KEEP_ALIVE') or '-1')
+LATENCY_WINDOW = 1000
+TIMINGS = ('queue_seconds', 'retrieval_seconds', 'generation_seconds', 'total_seconds')
+
+
+class ServiceStats:
+    def __init__(self, window=LATENCY_WINDOW):
+        self.started = time.time()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.timings = {name: deque(maxlen=window) for name in TIMINGS}
+        self._lock = threading.Lock()
+
+    def count(self, name, delta=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + delta)
+
+    def record(self, timings, failed=False):
+        with self._lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+                for name, value in timings.items():
+                    self.timings[name].append(value)
+
+    def snapshot(self, queue_depth):
+        with self._lock:
+            timings = {name: sorted(values) for name, values in self.timings.items()}
+            snapshot = {
+                'uptime_seconds': time.time() - self.started,
+                'queue_depth': queue_depth,
+                'in_flight': self.in_flight,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected
+            }
+        for name, values in timings.items():
+            key = name[:-len('_seconds')]
+            snapshot[f'{key}_p50_seconds'] = percentile(values, 50)
+            snapshot[f'{key}_p99_seconds'] = percentile(values, 99)
+        return snapshot
+
+
+class PrdService:
+    def __init__(self, workers=PRD_SERVICE_WORKERS, queue_size=PRD_SERVICE_QUEUE_SIZE, stream=STREAM_GENERATION,
+                 sectioned=SECTIONED_GENERATION, keep_alive=PRD_SERVICE_KEEP_ALIVE):
+        self.workers = max(1, workers)
+        self.stream = stream
+        self.sectioned = sectioned
+        self.keep_alive = keep_alive
+        self.requests = queue.Queue(maxsize=queue_size)
+        self.stats = ServiceStats()
+        self.threads = []
+        self._ids = itertools.count(1)
+
+    def warm(self):
+        started = time.perf_counter()
+        get_collection()
+        if index := get_lexical_index():
+            index.segment()
+        try:
+            preload_models(keep_alive=self.keep_alive)
+            retrieve_context('warm up')
+        except Exception as e:
+            logger.exception(f'Could not warm up Ollama, the first request will load the models: {e}')
+        logger.info(f'Service warmed up in {time.perf_counter() - started:.2f}s')
+
+    def start(self):
+        set_chat_parallelism(self.workers)
+        set_keep_alive(self.keep_alive)
+        self.warm()
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'prd-worker-{n}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        for _ in self.threads:
+            self.requests.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def submit(self, text, output_name=None, stream=None, sectioned=None):
+        future = Future()
+        output_name = safe_output_name(output_name) or f'prd_{time.strftime("%Y%m%d_%H%M%S")}_{next(self._ids)}'
+        job = (text, output_name, self.stream if stream is None else stream,
+               self.sectioned if sectioned is None else sectioned, time.perf_counter(), future)
+        try:
+            self.requests.put_nowait(job)
+        except queue.Full:
+            self.stats.count('rejected')
+            raise
+        self.stats.count('submitted')
+        return future
+
+    def _work(self):
+        while True:
+            job = self.requests.get()
+            if job is None:
+                return
+            text, output_name, stream, sectioned, queued_at, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.stats.count('in_flight')
+            started = time.perf_counter()
+            timings = {'queue_seconds': started - queued_at}
+            try:
+                context_str = retrieve_context(text, sectioned=sectioned)
+                retrieved = time.perf_counter()
+                timings['retrieval_seconds'] = retrieved - started
+                path = generate_and_write_prd(text, context_str, stream=stream, output_name=output_name,
+                                              sectioned=sectioned)
+                finished = time.perf_counter()
+                timings['generation_seconds'] = finished - retrieved
+                timings['total_seconds'] = finished - queued_at
+                self.stats.record(timings)
+                logger.info(f'Generated {path} in {timings["total_seconds"]:.2f}s '
+                            f'({timings["queue_seconds"]:.2f}s queued)')
+                future.set_result({'output': path, **timings})
+            except Exception as e:
+                logger.exception(f'Error while generating PRD {output_name}: {str(e)}')
+                self.stats.record(timings, failed=True)
+                future.set_exception(e)
+            finally:
+                self.stats.count('in_flight', -1)
+
+
+def safe_output_name(name):
+    if not name:
+        return None
+    return re.sub(r'[^\w.-]', '_', os.path.basename(str(name))).strip('.') or None
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            logger.debug(f'{self.address_string()} {format % args}')
+
+        def send_json(self, status, data):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self.send_json(200, {'status': 'ok'})
+            elif self.path == '/stats':
+                self.send_json(200, service.stats.snapshot(service.requests.qsize()))
+            else:
+                self.send_json(404, {'error': f'Unknown path {self.path}'})
+
+        def do_POST(self):
+            if self.path != '/generate':
+                self.send_json(404, {'error': f'Unknown path {self.path}'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                text = payload.get('text')
+                output_name = payload.get('output_name')
+                if not text and payload.get('file_path'):
+                    text = extract_text_from_docx(payload['file_path'])
+                    output_name = output_name or get_output_name(payload['file_path'])
+            except Exception as e:
+                self.send_json(400, {'error': f'Invalid request: {e}'})
+                return
+            if not text:
+                self.send_json(400, {'error': 'Request needs a non-empty "text" or a "file_path" to a .docx BRD'})
+                return
+
+            try:
+                future = service.submit(text, output_name=output_name, stream=payload.get('stream'),
+                                        sectioned=payload.get('sections'))
+            except queue.Full:
+                self.send_json(503, {'error': 'Generation queue is full, retry later'})
+                return
+            try:
+                self.send_json(200, future.result())
+            except Exception as e:
+                self.send_json(500, {'error': str(e)})
+
+    return Handler
+
+
+def serve(host=PRD_SERVICE_HOST, port=PRD_SERVICE_PORT, workers=PRD_SERVICE_WORKERS,
+          queue_size=PRD_SERVICE_QUEUE_SIZE, stream=STREAM_GENERATION, sectioned=SECTIONED_GENERATION):
+    service = PrdService(workers=workers, queue_size=queue_size, stream=stream, sectioned=sectioned).start()
+    httpd = ThreadingHTTPServer((host, port), make_handler(service))
+    httpd.daemon_threads = True
+    logger.info(f'PRD service listening on http://{host}:{httpd.server_address[1]} with {service.workers} workers')
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        service.stop()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serve PRD generation over HTTP with warm models and index')
+    parser.add_argument('--host', default=PRD_SERVICE_HOST)
+    parser.add_argument('--port', type=int, default=PRD_SERVICE_PORT)
+    parser.add_argument('--workers', type=int, default=PRD_SERVICE_WORKERS,
+                        help='Concurrent generations, match the Ollama server OLLAMA_NUM_PARALLEL')
+    parser.add_argument('--queue-size', type=int, default=PRD_SERVICE_QUEUE_SIZE,
+                        help='Requests allowed to wait before the service answers 503')
+    parser.add_argument('--stream', action='store_true', default=STREAM_GENERATION,
+                        help='Stream tokens to <output>.md as they are generated')
+    parser.add_argument('--sections', action='store_true', default=SECTIONED_GENERATION,
+                        help='Generate PRD sections concurrently from a shared outline by default')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    try:
+        serve(host=args.host, port=args.port, workers=args.workers, queue_size=args.queue_size, stream=args.stream,
+              sectioned=args.sections)
+    except KeyboardInterrupt:
+        logger.info('PRD service stopped')
@@ -1,35 +1,287 @@
+from concurrent.futures import ThreadPoolExecutor
 from docx import Document
+from ingestion.utils.docx_utils import extract_text_from_docx
 import logging
 import os
-from utils.db_utils import get_similar_docs
-from utils.ollama_utils import get_embedding, generate_prd
-from utils.text_utils import chunk_text
+import queue
+import re
+import threading
+import time
+from utils.db_utils import RETRIEVAL_TOP_K, get_docs, rank_similar_docs
+from utils.lexical_utils import get_lexical_index, merge_lexical_hits, reciprocal_rank_fusion
+from utils.ollama_utils import GENERATION_NUM_CTX, GENERATION_RESERVED_TOKENS, OLLAMA_NUM_PARALLEL, OUTLINE_MAX_TOKENS, PRD_SECTIONS, complete, get_embeddings, get_outline_prompt, get_promt, get_section_prompt, generate_prd, set_chat_parallelism, stream_prd
+from utils.text_utils import chunk_text, estimate_tokens
 
 GENERATED_PRD_PATH = os.getenv('GENERATED_PRD_PATH')
+STREAM_GENERATION = os.getenv('STREAM_GENERATION', 'false').lower() in ('1', 'true', 'yes')
+DEFAULT_PRD_NAME = 'prd'
+BATCH_RETRIEVAL_WORKERS = int(os.getenv('BATCH_RETRIEVAL_WORKERS', 4))
+SECTIONED_GENERATION = os.getenv('SECTIONED_GENERATION', 'false').lower() in ('1', 'true', 'yes')
+SECTION_WORKERS = int(os.getenv('SECTION_WORKERS', OLLAMA_NUM_PARALLEL))
+SECTION_CONTEXT_TOKENS = int(os.getenv('SECTION_CONTEXT_TOKENS', 1500))
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 300
 
 logger = logging.getLogger(__name__)
 
-def process_input_text(text):
+def process_input_text(text, stream=STREAM_GENERATION, output_name=DEFAULT_PRD_NAME, sectioned=SECTIONED_GENERATION):
     if not text:
         logger.debug('No Text to process')
         return
-    
+
+    context_str = retrieve_context(text, sectioned=sectioned)
+    return generate_and_write_prd(text, context_str, stream=stream, output_name=output_name, sectioned=sectioned)
+
+
+def retrieve_context(text, sectioned=False):
     chunks = chunk_text(text)
     logger.info(f'{len(chunks)} chunks created for Input BR')
-    context_docs = {}
-    for i, chunk in enumerate(chunks):
-        logger.info(f'Embedding chunk {i} in Input Text')
-        embedding = get_embedding(chunk)
-        results = get_similar_docs(embedding)
-        for k,v in results.items():
-            if k not in context_docs:
-                context_docs[k] = v
-    context_str = '\n\n'.join(str(v) for v in context_docs.values())
-    response = generate_prd(text, context_str)
-    write_prd_to_file(response)
-
-
-def write_prd_to_file(prd):
+    ranked_docs = rank_hybrid_docs(chunks)
+    if sectioned:
+        budget = min(SECTION_CONTEXT_TOKENS, context_token_budget(text, prompt=get_outline_prompt(text, '')))
+        return build_context(ranked_docs, budget)
+    return build_context(ranked_docs, context_token_budget(text))
+
+
+def rank_hybrid_docs(chunks, top_k=RETRIEVAL_TOP_K):
+    index = get_lexical_index()
+    lexical_results = [index.search(chunk) for chunk in chunks] if index else []
+    strong = {i for i, result in enumerate(lexical_results) if result.is_strong()}
+    vector_chunks = [chunk for i, chunk in enumerate(chunks) if i not in strong]
+    if strong:
+        logger.info(f'Skipping vector search for {len(strong)} of {len(chunks)} chunks with strong keyword matches')
+
+    vector_docs = rank_similar_docs(get_embeddings(vector_chunks)) if vector_chunks else []
+    lexical_hits = merge_lexical_hits(lexical_results, top_k)
+    if not lexical_hits:
+        return vector_docs
+
+    fused = reciprocal_rank_fusion([[doc['id'] for doc in vector_docs], [id for id, _ in lexical_hits]],
+                                   top_k=top_k)
+    docs = {doc['id']: doc for doc in vector_docs}
+    docs.update(get_docs([id for id, _ in fused if id not in docs]))
+    lexical_scores = dict(lexical_hits)
+    ranked = []
+    for id, score in fused:
+        if id not in docs:
+            continue
+        doc = dict(docs[id])
+        doc['fused_score'] = score
+        doc['lexical_score'] = lexical_scores.get(id)
+        ranked.append(doc)
+    logger.info(f'Fused {len(vector_docs)} vector and {len(lexical_hits)} keyword matches into {len(ranked)} docs')
+    return ranked
+
+
+def context_token_budget(text, num_ctx=GENERATION_NUM_CTX, reserved_tokens=GENERATION_RESERVED_TOKENS, prompt=None):
+    prompt_tokens = estimate_tokens(get_promt(text, '') if prompt is None else prompt)
+    budget = num_ctx - reserved_tokens - prompt_tokens
+    if budget <= 0:
+        logger.warning(f'Input alone needs ~{prompt_tokens} prompt tokens, leaving no room for reference PRDs '
+                       f'in a {num_ctx} token context')
+        return 0
+    return budget
+
+
+def build_context(ranked_docs, budget_tokens):
+    selected = []
+    by_position = {}
+    used_tokens = 0
+
+    for doc in ranked_docs:
+        text = str(doc.get('document') or '').strip()
+        metadata = doc.get('metadata') or {}
+        source = (metadata.get('page_id'), metadata.get('pdf', ''))
+        chunk_index = metadata.get('chunk_index')
+
+        if chunk_index is not None:
+            if (source, chunk_index) in by_position:
+                continue
+            previous = by_position.get((source, chunk_index - 1))
+            following = by_position.get((source, chunk_index + 1))
+            if previous:
+                text = text[overlap_length(previous['text'], text):].strip()
+            if following:
+                text = text[:len(text) - overlap_length(text, following['text'])].strip()
+        if not text or any(text in item['text'] for item in selected):
+            continue
+
+        tokens = estimate_tokens(text)
+        if used_tokens + tokens > budget_tokens:
+            continue
+        item = {'text': text}
+        selected.append(item)
+        used_tokens += tokens
+        if chunk_index is not None:
+            by_position[(source, chunk_index)] = item
+
+    logger.info(f'Packed {len(selected)} of {len(ranked_docs)} retrieved chunks into '
+                f'~{used_tokens}/{budget_tokens} context tokens')
+    return '\n\n'.join(item['text'] for item in selected)
+
+
+def overlap_length(head, tail):
+    for size in range(min(len(head), len(tail), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if head.endswith(tail[:size]):
+            return size
+    return 0
+
+
+def generate_and_write_prd(text, context_str, stream=STREAM_GENERATION, output_name=DEFAULT_PRD_NAME,
+                           sectioned=SECTIONED_GENERATION):
+    if sectioned:
+        if stream:
+            logger.info('Streaming is not supported for sectioned generation, writing the PRD when all sections finish')
+        response = generate_sectioned_prd(text, context_str)
+    elif stream:
+        response = stream_prd_to_file(text, context_str, output_name=output_name)
+    else:
+        response = generate_prd(text, context_str)
+    return write_prd_to_file(response, output_name=output_name)
+
+
+def generate_sectioned_prd(text, context_str, workers=SECTION_WORKERS):
+    started = time.perf_counter()
+    outline = complete(get_outline_prompt(text, context_str), max_tokens=OUTLINE_MAX_TOKENS)
+    title, points = parse_outline(outline)
+    logger.info(f'Outline with {sum(1 for p in points.values() if p)} of {len(PRD_SECTIONS)} sections '
+                f'generated in {time.perf_counter() - started:.2f}s')
+
+    def write_section(number, section):
+        section_started = time.perf_counter()
+        section_title, description = section
+        query = '\n'.join([f'{section_title}: {description}', points.get(section_title) or text])
+        section_context = build_context(rank_hybrid_docs(chunk_text(query)), section_context_budget(
+            text, outline, number, section_title, description))
+        content = complete(get_section_prompt(text, outline, number, section_title, description, section_context))
+        logger.info(f'Section "{section_title}" generated in {time.perf_counter() - section_started:.2f}s')
+        return ensure_section_heading(content, number, section_title)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        sections = list(executor.map(write_section, range(1, len(PRD_SECTIONS) + 1), PRD_SECTIONS))
+    logger.info(f'Generated {len(sections)} sections with {workers} workers in {time.perf_counter() - started:.2f}s')
+    return '\n\n'.join(([f'# {title}'] if title else []) + sections)
+
+
+def section_context_budget(text, outline, number, title, description):
+    prompt = get_section_prompt(text, outline, number, title, description, '')
+    return min(SECTION_CONTEXT_TOKENS, context_token_budget(text, prompt=prompt))
+
+
+def parse_outline(outline):
+    title = None
+    points = {}
+    current = None
+    for line in (outline or '').splitlines():
+        stripped = line.strip()
+        if stripped.startswith('# ') and title is None and current is None:
+            title = stripped[2:].strip()
+        elif stripped.startswith('#'):
+            current = match_section(stripped.lstrip('#'))
+            if current:
+                points.setdefault(current, [])
+        elif current and stripped:
+            points[current].append(stripped)
+    return title, {section: '\n'.join(lines) for section, lines in points.items()}
+
+
+def match_section(heading):
+    heading = normalize_heading(heading)
+    if not heading:
+        return None
+    names = sorted(((normalize_heading(title), title) for title, _ in PRD_SECTIONS), key=lambda item: -len(item[0]))
+    for matches in (lambda name: name == heading, lambda name: name in heading, lambda name: heading in name):
+        for name, title in names:
+            if matches(name):
+                return title
+    return None
+
+
+def normalize_heading(heading):
+    return ' '.join(re.sub(r'[^a-z ]', ' ', heading.lower()).split())
+
+
+def ensure_section_heading(content, number, title):
+    content = (content or '').strip()
+    if content.startswith('#'):
+        return content
+    return f'## {number}. {title}\n\n{content or "> TBD"}'
+
+
+def process_input_files(file_paths, stream=STREAM_GENERATION, retrieval_workers=BATCH_RETRIEVAL_WORKERS,
+                        llm_parallel=OLLAMA_NUM_PARALLEL, sectioned=SECTIONED_GENERATION):
+    set_chat_parallelism(llm_parallel)
+    generation_queue = queue.Queue(maxsize=llm_parallel)
+    results = {}
+    results_lock = threading.Lock()
+
+    def record(file_path, ok):
+        with results_lock:
+            results[file_path] = ok
+
+    def prepare(file_path):
+        try:
+            text = extract_text_from_docx(file_path)
+            if not text:
+                logger.warning(f'No text found in {file_path}')
+                record(file_path, False)
+                return
+            context_str = retrieve_context(text, sectioned=sectioned)
+            generation_queue.put((file_path, text, context_str))
+        except Exception as e:
+            logger.exception(f'Error while retrieving context for {file_path}: {str(e)}')
+            record(file_path, False)
+
+    def generate_worker():
+        while True:
+            item = generation_queue.get()
+            try:
+                if item is None:
+                    return
+                file_path, text, context_str = item
+                output_name = get_output_name(file_path)
+                generate_and_write_prd(text, context_str, stream=stream, output_name=output_name, sectioned=sectioned)
+                logger.info(f'PRD generated for {file_path} as {output_name}.docx')
+                record(file_path, True)
+            except Exception as e:
+                logger.exception(f'Error while generating PRD for {item[0]}: {str(e)}')
+                record(item[0], False)
+            finally:
+                generation_queue.task_done()
+
+    generators = [threading.Thread(target=generate_worker, daemon=True) for _ in range(llm_parallel)]
+    for t in generators:
+        t.start()
+    with ThreadPoolExecutor(max_workers=retrieval_workers) as executor:
+        list(executor.map(prepare, file_paths))
+    for _ in generators:
+        generation_queue.put(None)
+    for t in generators:
+        t.join()
+
+    succeeded = sum(1 for ok in results.values() if ok)
+    logger.info(f'Generated {succeeded} of {len(file_paths)} PRDs')
+    return results
+
+
+def get_output_name(file_path):
+    return f'{os.path.splitext(os.path.basename(file_path))[0]}_prd'
+
+
+def stream_prd_to_file(text, context_str, output_name=DEFAULT_PRD_NAME):
+    save_path = f'{GENERATED_PRD_PATH}/{output_name}.md'
+    parts = []
+    stats = {}
+    with open(save_path, 'w', encoding='utf-8') as f:
+        for token in stream_prd(text, context_str, stats=stats):
+            parts.append(token)
+            f.write(token)
+            f.flush()
+    logger.info(f'Streamed PRD markdown to {save_path}')
+    return ''.join(parts)
+
+
+def write_prd_to_file(prd, output_name=DEFAULT_PRD_NAME):
     doc = Document()
     for line in prd.splitlines():
         line = line.strip()
@@ -47,6 +299,7 @@ def write_prd_to_file(prd):
             doc.add_paragraph(line)
         else:
             doc.add_paragraph(line)  
-    save_path = f'{GENERATED_PRD_PATH}/prd.docx'
+    save_path = f'{GENERATED_PRD_PATH}/{output_name}.docx'
     doc.save(save_path)
+    return save_path
 
@@ -1,5 +1,8 @@
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import chain
 import logging
-from ingestion.utils.confluence_utils import fetch_page_id_from_title, collect_subpages, get_page_content, process_and_store
+from ingestion.utils.confluence_utils import CONFLUENCE_LINK_DEPTH, CONFLUENCE_MAX_WORKERS, CrawlFrontier, fetch_page_from_title, iter_subpages, get_page_content, is_complete_page, remove_missing_pages, store_pages
+from ingestion.utils.manifest_utils import get_manifest
 
 logging.basicConfig(
     level=logging.INFO,  # Set the log level
@@ -7,40 +10,76 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def fetch_and_store_historical_docs(pages):
-    page_ids = []
-    for space, title in pages:
-        logger.info(f'Searching for title: "{title}" in space: "{space}"')
-        try:
-            p_id = fetch_page_id_from_title(title, space)
-            if not p_id:
-                logger.warning(f'Could not find page "{title}" in space "{space}"')
+def fetch_and_store_historical_docs(pages, max_workers=CONFLUENCE_MAX_WORKERS, max_depth=CONFLUENCE_LINK_DEPTH):
+    frontier = CrawlFrontier(max_depth=max_depth)
+    depth = 0
+    level = frontier.admit(pages, depth)
+    stages = []
+
+    while level:
+        logger.info(f'Crawling {len(level)} pages at link depth {depth}')
+        linked_pages = []
+        stages.extend(store_pages(crawl_pages(level, frontier, max_workers=max_workers, linked_pages=linked_pages),
+                                  linked_pages=linked_pages) or [])
+        depth += 1
+        level = frontier.admit(linked_pages, depth)
+    logger.info(f'Crawl finished with {len(frontier.visited_ids)} unique pages')
+    return stages
+
+
+def crawl_pages(pages, frontier=None, max_workers=CONFLUENCE_MAX_WORKERS, linked_pages=None):
+    manifest = get_manifest()
+    frontier = frontier or CrawlFrontier()
+    refetches = {}
+    total = 0
+
+    def completed_refetches(block=False):
+        if not refetches:
+            return
+        done, _ = wait(refetches, timeout=None if block else 0,
+                       return_when=ALL_COMPLETED if block else FIRST_COMPLETED)
+        for future in done:
+            p_id, root = refetches.pop(future)
+            content = future.result()
+            if not content:
+                logger.warning(f'Could not fetch content for page ID: {p_id}')
                 continue
-            page_ids.append(p_id)
-            child_pages = collect_subpages(p_id)
-            logger.info(f'Found {len(child_pages)} child pages under "{title}"')
-            page_ids.extend(child_pages)
-        except Exception as e:
-            logger.exception(f'Error processing "{title}" in space "{space}": {e}')
-    
-    logger.info(f'Total pages to process: {len(page_ids)}')
-    unique_page_ids = list(set(page_ids))
-    logger.info(f'Unique pages to process: {len(unique_page_ids)}')
-
-    pages_with_content = []
-    for id in unique_page_ids:
-        content = get_page_content(id)
-        if not content:
-            logger.warning(f'Could not fetch content for page ID: {id}')
-            continue
-        pages_with_content.append(content)
-    logger.info(f'Successfully fetched content for {len(pages_with_content)} pages')
-
-    if pages_with_content:
-        try:
-            process_and_store(pages_with_content)
-        except Exception as e:
-            logger.exception(f'Error processing pages: {e}')
+            yield content, root
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for space, title in pages:
+            logger.info(f'Searching for title: "{title}" in space: "{space}"')
+            try:
+                root_page = fetch_page_from_title(title, space)
+                if not root_page or not root_page.get('id'):
+                    logger.warning(f'Could not find page "{title}" in space "{space}"')
+                    continue
+                if frontier.is_visited(root_page.get('id')):
+                    logger.info(f'Skipping "{title}" in space "{space}", already crawled')
+                    continue
+                root = f'{space}/{title}'
+                crawled_ids = []
+                for page in chain([root_page], iter_subpages(root_page.get('id'), max_workers=max_workers)):
+                    p_id = page.get('id')
+                    crawled_ids.append(p_id)
+                    total += 1
+                    if not frontier.visit(p_id):
+                        continue
+                    if is_complete_page(page):
+                        yield page, root
+                    elif not manifest.is_unchanged(p_id, page.get('version', {}).get('number')):
+                        refetches[executor.submit(get_page_content, p_id)] = (p_id, root)
+                    elif linked_pages is not None:
+                        entry = manifest.get(p_id) or {}
+                        linked_pages.extend(tuple(link) for link in entry.get('linked_pages', []))
+                    yield from completed_refetches()
+                logger.info(f'Found {len(crawled_ids) - 1} child pages under "{title}"')
+                remove_missing_pages(root, crawled_ids)
+            except Exception as e:
+                logger.exception(f'Error processing "{title}" in space "{space}": {e}')
+
+        yield from completed_refetches(block=True)
+    logger.info(f'Crawled {total} pages, {len(frontier.visited_ids)} unique so far')
 
 
 if __name__ == '__main__':
@@ -50,4 +89,4 @@ if __name__ == '__main__':
         ]
         fetch_and_store_historical_docs(target_pages)
     except KeyboardInterrupt:
-        logger.exception('Interrupted by user.')
\ No newline at end of file
+        logger.exception('Interrupted by user.')
@@ -1,7 +1,12 @@
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from dotenv import load_dotenv
+from itertools import islice
 import logging
-from ingestion.utils.docx_utils import get_prds, extract_date_from_document, extract_text_from_docx
-from utils.text_utils import process_text
+import os
+from ingestion.utils.docx_utils import get_prds, parse_prd
+from utils.db_utils import BulkWriter
+from utils.text_utils import process_documents
 
 logging.basicConfig(
     level=logging.INFO,
@@ -12,25 +17,64 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-def process_prds():
-    files = get_prds()
-    for f, p in files.items():
+PRD_PARSE_WORKERS = int(os.getenv('PRD_PARSE_WORKERS', os.cpu_count() or 1))
+PRD_PARSE_WINDOW_FACTOR = 2
+
+
+def process_prds(workers=PRD_PARSE_WORKERS):
+    files = {}
+    for f, p in get_prds().items():
         if not f.lower().endswith('docx'):
             logger.warning(f'File {f} is not a .docx file')
             continue
-        try:
-            created_at, updated_at = extract_date_from_document(p)
-            text = extract_text_from_docx(p)
-            page = {
-                'title': f,
-                'page_id': f,
-                'created_at': created_at,
-                'updated_at': updated_at
-            }
-            process_text(text, page)
-        except Exception as e:
-            logger.error(f'Error processing doc {f}: {str(e)}')
+        files[f] = p
+
+    with BulkWriter() as writer:
+        doc_ids = process_documents(iter_parsed_prds(files, workers), writer=writer)
+    logger.info(f'Stored {len(doc_ids)} chunks from {len(files)} PRDs')
+
+
+def iter_parsed_prds(files, workers=PRD_PARSE_WORKERS):
+    if workers <= 1:
+        for f, p in files.items():
+            if (page := parse_prd_safely(f, p)):
+                yield page.pop('text'), page, ''
+        return
+
+    pending_files = iter(files.items())
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for f, p in islice(pending_files, workers * PRD_PARSE_WINDOW_FACTOR):
+            futures[executor.submit(parse_prd, f, p)] = f
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                f = futures.pop(future)
+                for next_f, next_p in islice(pending_files, 1):
+                    futures[executor.submit(parse_prd, next_f, next_p)] = next_f
+                try:
+                    page = future.result()
+                except Exception as e:
+                    logger.error(f'Error processing doc {f}: {str(e)}')
+                    continue
+                yield page.pop('text'), page, ''
+
+
+def parse_prd_safely(f, p):
+    try:
+        return parse_prd(f, p)
+    except Exception as e:
+        logger.error(f'Error processing doc {f}: {str(e)}')
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Ingest local PRDs from LOCAL_PRDs into the vector store')
+    parser.add_argument('--workers', type=int, default=PRD_PARSE_WORKERS,
+                        help='Processes used to parse DOCX files, 1 parses in the main process')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    process_prds()
\ No newline at end of file
+    args = parse_args()
+    process_prds(workers=args.workers)
\ No newline at end of file
@@ -1,10 +1,21 @@
 from bs4 import BeautifulSoup
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
+from functools import lru_cache, partial
+from itertools import chain
 import logging
 import os
 from pathlib import Path
 import requests
-from utils.text_utils import process_pdf, process_text
+import tempfile
+import threading
+from ingestion.utils.http_utils import RateLimitedClient
+from ingestion.utils.manifest_utils import get_manifest, hash_content
+from ingestion.utils.storage_utils import extract_storage_content
+from utils.db_utils import BulkWriter, delete_docs
+from utils.ollama_utils import EMBED_BATCH_SIZE
+from utils.pipeline_utils import Pipeline, Stage
+from utils.text_utils import add_duplicate_chunk, embed_chunks, iter_document_chunks, iter_pdf_documents, make_doc_id
 
 
 logger = logging.getLogger(__name__)
@@ -19,41 +30,140 @@ CONF_AUTH_CREDS = (USERNAME, API_KEY)
 HEADERS = {
     'Accept': 'application/json'
 }
+CONFLUENCE_MAX_WORKERS = int(os.getenv('CONFLUENCE_MAX_WORKERS', 8))
+CONFLUENCE_TIMEOUT = float(os.getenv('CONFLUENCE_TIMEOUT', 30))
+CONFLUENCE_MAX_RETRIES = int(os.getenv('CONFLUENCE_MAX_RETRIES', 5))
+CONFLUENCE_BACKOFF_BASE = float(os.getenv('CONFLUENCE_BACKOFF_BASE', 1))
+CONFLUENCE_BACKOFF_MAX = float(os.getenv('CONFLUENCE_BACKOFF_MAX', 60))
+CONFLUENCE_RATE_LIMIT = float(os.getenv('CONFLUENCE_RATE_LIMIT', 10))
+PAGE_EXPAND = 'body.storage,version,history,space'
+CONFLUENCE_LINK_DEPTH = int(os.getenv('CONFLUENCE_LINK_DEPTH', 3))
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+ATTACHMENT_CACHE_SIZE = 256
+INGEST_PARSE_WORKERS = int(os.getenv('INGEST_PARSE_WORKERS', 2))
+INGEST_CHUNK_WORKERS = int(os.getenv('INGEST_CHUNK_WORKERS', 4))
+INGEST_EMBED_WORKERS = int(os.getenv('INGEST_EMBED_WORKERS', 2))
+CONFLUENCE_DOWNLOAD_WORKERS = int(os.getenv('CONFLUENCE_DOWNLOAD_WORKERS', CONFLUENCE_MAX_WORKERS))
+CONFLUENCE_POOL_SIZE = 2 * CONFLUENCE_MAX_WORKERS + CONFLUENCE_DOWNLOAD_WORKERS + INGEST_CHUNK_WORKERS + 1
+
+_client = None
+_client_lock = threading.Lock()
+_download_executor = None
+_title_cache = {}
+_title_cache_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = RateLimitedClient(
+                auth=CONF_AUTH_CREDS,
+                headers=HEADERS,
+                pool_size=CONFLUENCE_POOL_SIZE,
+                timeout=CONFLUENCE_TIMEOUT,
+                max_retries=CONFLUENCE_MAX_RETRIES,
+                backoff_base=CONFLUENCE_BACKOFF_BASE,
+                backoff_max=CONFLUENCE_BACKOFF_MAX,
+                rate_limit=CONFLUENCE_RATE_LIMIT
+            )
+        return _client
+
+
+def get_download_executor():
+    global _download_executor
+    with _client_lock:
+        if _download_executor is None:
+            _download_executor = ThreadPoolExecutor(max_workers=CONFLUENCE_DOWNLOAD_WORKERS,
+                                                    thread_name_prefix='confluence-download')
+        return _download_executor
 
 
 def fetch_page_id_from_title(title, space_key):
+    page = fetch_page_from_title(title, space_key)
+    if page:
+        return page.get('id')
+    return None
+
+
+def fetch_page_from_title(title, space_key):
+    key = (space_key, title)
+    with _title_cache_lock:
+        if key in _title_cache:
+            return _title_cache[key]
+    page, found = lookup_page_by_title(title, space_key)
+    if found:
+        with _title_cache_lock:
+            _title_cache[key] = page
+    return page
+
+
+def lookup_page_by_title(title, space_key):
     url = f'{BASE_URL}/rest/api/content'
     params = {
         'spaceKey': space_key,
         'title': title,
-        'expand': 'ancestors'
+        'expand': f'ancestors,{PAGE_EXPAND}'
     }
 
     try:
-        response = requests.get(url, auth=CONF_AUTH_CREDS, headers=HEADERS, params=params)
+        response = get_client().get(url, params=params)
         response.raise_for_status()
         result = response.json().get('results', [])
 
         if not result:
             logger.warning(f'Page "{title}" not found in space "{space_key}"')
-            return None
-        return result[0].get('id')
+            return None, True
+        return result[0], True
     except Exception as e:
         logger.exception(f'Error fetching page "{title}".\n {str(e)}')
-        
+        return None, False
 
-def collect_subpages(page_id):
-    all_pages = []
 
-    def recurse(pid):
-        child_pages = get_child_pages(pid)
-        for page in child_pages:
-            id = page.get('id')
-            if id:
-                all_pages.append(id)
-                recurse(id)
-    recurse(page_id)
-    return all_pages
+class CrawlFrontier:
+    def __init__(self, max_depth=CONFLUENCE_LINK_DEPTH):
+        self.max_depth = max_depth
+        self.visited_titles = set()
+        self.visited_ids = set()
+        self._lock = threading.Lock()
+
+    def admit(self, pages, depth=0):
+        admitted = []
+        with self._lock:
+            for space, title in pages:
+                if (space, title) in self.visited_titles or (space, title) in admitted:
+                    continue
+                admitted.append((space, title))
+            if depth > self.max_depth:
+                if admitted:
+                    logger.info(f'Not following {len(admitted)} links beyond depth {self.max_depth}')
+                return []
+            self.visited_titles.update(admitted)
+        return admitted
+
+    def visit(self, page_id):
+        with self._lock:
+            if page_id in self.visited_ids:
+                return False
+            self.visited_ids.add(page_id)
+            return True
+
+    def is_visited(self, page_id):
+        with self._lock:
+            return page_id in self.visited_ids
+
+
+def iter_subpages(page_id, max_workers=CONFLUENCE_MAX_WORKERS):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(get_child_pages, page_id)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for page in future.result():
+                    id = page.get('id')
+                    if id:
+                        pending.add(executor.submit(get_child_pages, id))
+                        yield page
 
 
 def get_child_pages(page_id):
@@ -66,22 +176,25 @@ def get_child_pages(page_id):
         params = {
             'start': start,
             'limit': limit,
-            'expand': 'body.storage, version, history'
+            'expand': PAGE_EXPAND
         }
         try:
-            response = requests.get(url, auth=CONF_AUTH_CREDS, headers=HEADERS, params=params)
+            response = get_client().get(url, params=params)
+            if response.status_code == 404:
+                logger.warning(f'Page {page_id} disappeared while fetching its child pages')
+                break
             response.raise_for_status()
             data = response.json()
+        except Exception as e:
+            logger.error(f'Error fetching child pages for {page_id} after retries:\n {str(e)}')
+            raise
 
-            children = data.get('results', [])
-            all_children.extend(children)
+        children = data.get('results', [])
+        all_children.extend(children)
 
-            if len(children) < limit:
-                break
-            start += limit
-        except Exception as e:
-            logger.exception(f'Error fetching child pages for {page_id}:\n {str(e)}')
+        if len(children) < limit:
             break
+        start += limit
 
     return all_children
 
@@ -89,10 +202,10 @@ def get_child_pages(page_id):
 def get_page_content(page_id):
     url = f'{BASE_URL}/rest/api/content/{page_id}'
     params = {
-        'expand': 'body.storage,version,history'
-    }   
+        'expand': PAGE_EXPAND
+    }
     try:
-        response = requests.get(url, auth=CONF_AUTH_CREDS, headers=HEADERS, params=params)
+        response = get_client().get(url, params=params)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -100,30 +213,202 @@ def get_page_content(page_id):
         return None
 
 
-def process_and_store(pages):
-    if not pages:
-        logger.warning(f'No Pages to Process')
+def is_complete_page(page):
+    if not page or not page.get('id'):
+        return False
+    storage = page.get('body', {}).get('storage', {})
+    if not storage.get('value'):
+        return False
+    return 'version' in page and 'history' in page
 
-    for page in pages:
-        try:
-            page_data = get_page_details(page)
-            body = page_data.get('body')
-            title = page_data.get('title')
-
-            if not body:
-                logger.warning(f'No content found for page {title}')
-                continue
 
-            parsed_page = parse_confluence_page(body)
-
-            if not parsed_page:
-                logger.warning(f'No content found after cleaning page "{title}"')
-                continue
+def store_pages(page_source, linked_pages=None):
+    manifest = get_manifest()
+    try:
+        with BulkWriter() as writer:
+            sync = PageSync(writer, manifest)
+            pipeline = Pipeline([
+                Stage('parse', lambda item: parse_page(*item, manifest=manifest, linked_pages=linked_pages),
+                      workers=INGEST_PARSE_WORKERS),
+                Stage('chunk', lambda page: chunk_page(page, sync), workers=INGEST_CHUNK_WORKERS),
+                Stage('embed', embed_chunks, workers=INGEST_EMBED_WORKERS, batch_size=EMBED_BATCH_SIZE),
+                Stage('write', lambda item: sync.write(*item), workers=1)
+            ])
+            return pipeline.run(page_source)
+    finally:
+        manifest.save()
+
+
+def parse_page(page, root=None, manifest=None, linked_pages=None):
+    page_data = get_page_details(page)
+    body = page_data.get('body')
+    title = page_data.get('title')
+    content_hash = hash_content(body)
+
+    if manifest and manifest.is_unchanged(page_data.get('page_id'), page_data.get('version'), content_hash):
+        logger.debug(f'Skipping unchanged page "{title}"')
+        if linked_pages is not None:
+            entry = manifest.get(page_data.get('page_id')) or {}
+            linked_pages.extend(tuple(link) for link in entry.get('linked_pages', []))
+        return
 
-            parsed_page.update(page_data)
-            process_parsed_page(parsed_page)
-        except Exception as e:
-            logger.exception(f'Error while processing page "{title}": {str(e)}')
+    if not body:
+        logger.warning(f'No content found for page {title}')
+        return
+
+    parsed_page = parse_confluence_page(body)
+
+    if not parsed_page:
+        logger.warning(f'No content found after cleaning page "{title}"')
+        return
+
+    parsed_page.update(page_data)
+    parsed_page['content_hash'] = content_hash
+    parsed_page['root'] = root
+    if parsed_page.get('linked_pages'):
+        page_space = page_data.get('space') or (root or '').split('/', 1)[0]
+        parsed_page['linked_pages'] = [(page_space if space == 'Unknown' and page_space else space, title)
+                                       for space, title in parsed_page['linked_pages']]
+        if linked_pages is not None:
+            linked_pages.extend(parsed_page['linked_pages'])
+    yield parsed_page
+
+
+def chunk_page(page, sync):
+    sync.start(page)
+    documents = [(page.get('text', ''), page, '')]
+    skipped = []
+    pdf_documents = iter_pdf_documents(page.get('pdfs', []), page, on_skip=skipped.append)
+    chunk_count = 0
+    for item in iter_document_chunks(chain(documents, pdf_documents)):
+        chunk_count += 1
+        if not sync.add_duplicate(item):
+            yield item
+    sync.expect(page.get('page_id'), chunk_count, skipped=len(skipped))
+
+
+class PageSync:
+    def __init__(self, writer, manifest=None):
+        self.writer = writer
+        self.manifest = manifest
+        self.pages = {}
+        self.unflushed = []
+        self._lock = threading.Lock()
+        writer.on_flush = self.flushed
+
+    def start(self, page):
+        with self._lock:
+            self.pages[page.get('page_id')] = {
+                'page': page,
+                'expected': None,
+                'doc_ids': [],
+                'failed': 0,
+                'skipped': 0
+            }
+
+    def expect(self, page_id, count, skipped=0):
+        with self._lock:
+            state = self.pages[page_id]
+            state['expected'] = count
+            state['skipped'] = skipped
+            finished = self._pop_if_finished(page_id)
+        if finished:
+            self.finish(finished)
+
+    def add_duplicate(self, item):
+        doc_id = add_duplicate_chunk(item, self.writer)
+        if doc_id:
+            self._record(item[0].get('page_id', ''), doc_id)
+        return doc_id
+
+    def write(self, item, embedding):
+        page, pdf, chunk_idx, chunk = item
+        page_id = page.get('page_id', '')
+        doc_id = None
+        if embedding is None:
+            logger.warning(f'Failed to generate embedding for chunk {chunk_idx} of page: {page.get("title")}')
+        else:
+            doc_id = make_doc_id(page_id, chunk_idx, pdf)
+            self.writer.add(page, chunk_idx, chunk, doc_id, embedding, pdf)
+        self._record(page_id, doc_id)
+        return ()
+
+    def _record(self, page_id, doc_id):
+        with self._lock:
+            state = self.pages[page_id]
+            if doc_id:
+                state['doc_ids'].append(doc_id)
+            else:
+                state['failed'] += 1
+            finished = self._pop_if_finished(page_id)
+        if finished:
+            self.finish(finished)
+
+    def _pop_if_finished(self, page_id):
+        state = self.pages[page_id]
+        if state['expected'] is None or len(state['doc_ids']) + state['failed'] < state['expected']:
+            return None
+        return self.pages.pop(page_id)
+
+    def finish(self, state):
+        page = state['page']
+        doc_ids = state['doc_ids']
+        title = page.get('title')
+        if not doc_ids and (state['failed'] or state['skipped']):
+            logger.warning(f'No chunks stored for page "{title}", keeping previous sync state')
+            return
+        logger.info(f'Stored {len(doc_ids)} chunks for page "{title}"')
+        if not self.manifest:
+            return
+
+        page_id = page.get('page_id')
+        previous = self.manifest.get(page_id) or {}
+        version = page.get('version')
+        chunk_ids = doc_ids
+        stale = set()
+        if state['failed'] or state['skipped']:
+            logger.warning(f'{state["failed"]} chunks and {state["skipped"]} attachments of page "{title}" failed, '
+                           f'it will be retried on the next sync')
+            version = None
+            chunk_ids = sorted(set(doc_ids) | set(previous.get('chunk_ids', [])))
+        else:
+            stale = set(previous.get('chunk_ids', [])) - set(doc_ids)
+        update = partial(self.manifest.update, page_id, version, page.get('updated_at'), page.get('content_hash'),
+                         chunk_ids, root=page.get('root') or previous.get('root'),
+                         linked_pages=page.get('linked_pages', []))
+        if stale:
+            self.writer.flush()
+            delete_docs(stale)
+            update()
+        else:
+            with self._lock:
+                self.unflushed.append(update)
+
+    def flushed(self, failed=False):
+        with self._lock:
+            updates, self.unflushed = self.unflushed, []
+        if failed:
+            if updates:
+                logger.warning(f'Not recording {len(updates)} pages in the sync manifest after a failed write, '
+                               f'they will be retried on the next sync')
+            return
+        for update in updates:
+            update()
+
+
+def remove_missing_pages(root, seen_page_ids):
+    manifest = get_manifest()
+    seen_page_ids = {str(page_id) for page_id in seen_page_ids}
+    removed = 0
+    for page_id in manifest.pages_under_root(root):
+        if page_id in seen_page_ids:
+            continue
+        entry = manifest.remove(page_id)
+        delete_docs(entry.get('chunk_ids', []))
+        removed += 1
+    if removed:
+        logger.info(f'Removed {removed} pages no longer under "{root}"')
+        manifest.save()
 
 
 def get_page_details(page):
@@ -137,7 +422,9 @@ def get_page_details(page):
             'title': page.get('title', 'Untitled'),
             'body': page.get('body', {}).get('storage', {}).get('value', ''),
             'created_at': history_info.get('createdDate', ''),
-            'updated_at': version_info.get('when', '')
+            'updated_at': version_info.get('when', ''),
+            'version': version_info.get('number'),
+            'space': page.get('space', {}).get('key', '')
         }
 
 
@@ -146,6 +433,20 @@ def parse_confluence_page(body):
     if not body:
         return page
 
+    content = extract_storage_content(body)
+    page['pdfs'] = content['pdfs']
+    if content['linked_pages']:
+        page['linked_pages'] = content['linked_pages']
+    if content['text']:
+        page['text'] = content['text']
+    return page
+
+
+def parse_confluence_page_soup(body):
+    page = {}
+    if not body:
+        return page
+
     soup = BeautifulSoup(body, 'html.parser')
     attachments = extract_attachments_and_links(soup)
     page.update(attachments)
@@ -192,46 +493,95 @@ def extract_linked_pages(soup):
     return linked_pages
 
 
-def process_parsed_page(page):
-    from ingestion.confluence import fetch_and_store_historical_docs
+@lru_cache(maxsize=ATTACHMENT_CACHE_SIZE)
+def get_attachments(page_id):
+    url = f'{BASE_URL}/rest/api/content/{page_id}/child/attachment'
+    attachments = {}
+    start = 0
+    limit = 100
+
+    while True:
+        params = {
+            'start': start,
+            'limit': limit,
+            'expand': 'version'
+        }
+        response = get_client().get(url, params=params)
+        response.raise_for_status()
+        results = response.json().get('results', [])
+        for file in results:
+            if title := file.get('title'):
+                attachments.setdefault(title.lower(), file)
+        if len(results) < limit:
+            break
+        start += limit
+    return attachments
 
-    pdfs = page.get('pdfs', [])
-    text = page.get('text', '')
-    linked_pages = page.get('linked_pages', [])
-    process_pdf(pdfs, page)
-    process_text(text, page)
 
-    if linked_pages:
-        fetch_and_store_historical_docs(linked_pages)
+def download_attachments(page_id, safe_title, target_filenames):
+    target_filenames = list(dict.fromkeys(target_filenames))
+    try:
+        get_attachments(page_id)
+    except requests.exceptions.RequestException as e:
+        logger.exception(f'Error listing attachments for page {page_id}: {e}')
+        for filename in target_filenames:
+            yield filename, None
+        return
+    executor = get_download_executor()
+    futures = [(filename, executor.submit(download_attachment, page_id, safe_title, filename))
+               for filename in target_filenames]
+    for filename, future in futures:
+        yield filename, future.result()
 
 
 def download_attachment(page_id, safe_title, target_filename):
-    url = f'{BASE_URL}/rest/api/content/{page_id}/child/attachment'
-    
     try:
-        response = requests.get(url, auth=CONF_AUTH_CREDS, headers=HEADERS)
-        response.raise_for_status()
+        file = get_attachments(page_id).get(target_filename.lower())
+        if not file:
+            logger.warning(f'Attachment {target_filename} not found on page {page_id}')
+            return None
+        download_link = file.get('_links', {}).get('download', '')
+        if not download_link:
+            return None
 
-        attachments = response.json().get('results', [])
-        for file in attachments:
-            if file.get('title').lower() == target_filename.lower():
-                download_link = file.get('_links', {}).get('download', '')
-                if not download_link:
-                    continue
-                  
-                download_url = f'{BASE_URL}{download_link}'
-                res = requests.get(download_url, auth=CONF_AUTH_CREDS, headers=HEADERS)
-                res.raise_for_status()
-
-                path = Path(f'{BASE_DOWNLOAD_PATH}/{safe_title}/pdfs/{target_filename}')
-                path.parent.mkdir(parents=True, exist_ok=True)
-
-                with open(path, 'wb') as f:
-                    f.write(res.content)
-                logger.info(f'Downloaded attachment: {path}')
-                return str(path)
-                
-    except requests.exceptions.RequestException as e:
+        path = Path(f'{BASE_DOWNLOAD_PATH}/{safe_title}/pdfs/{file.get("id") or page_id}/{target_filename}')
+        version_path = path.with_name(f'{path.name}.version')
+        version = str(file.get('version', {}).get('number', ''))
+        if is_downloaded(path, version_path, file, version):
+            logger.debug(f'Attachment already downloaded: {path}')
+            return str(path)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        stream_to_file(f'{BASE_URL}{download_link}', path)
+        if version:
+            version_path.write_text(version)
+        logger.info(f'Downloaded attachment: {path}')
+        return str(path)
+    except (requests.exceptions.RequestException, OSError) as e:
         logger.exception(f'Error downloading attachment {target_filename} from page {page_id}: {e}')
-    
+
     return None
+
+
+def is_downloaded(path, version_path, file, version):
+    if not path.is_file():
+        return False
+    if version and version_path.is_file():
+        return version_path.read_text().strip() == version
+    file_size = file.get('extensions', {}).get('fileSize')
+    return file_size is not None and path.stat().st_size == file_size
+
+
+def stream_to_file(url, path, block_size=DOWNLOAD_BLOCK_SIZE):
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f'{path.name}.', suffix='.part', delete=False) as f:
+        tmp_path = Path(f.name)
+    try:
+        with get_client().get(url, stream=True) as res:
+            res.raise_for_status()
+            with open(tmp_path, 'wb') as f:
+                for block in res.iter_content(chunk_size=block_size):
+                    f.write(block)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
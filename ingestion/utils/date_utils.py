@@ -0,0 +1,97 @@
+import dateparser
+from datetime import datetime, timezone
+from functools import lru_cache
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+DATE_CACHE_SIZE = 8192
+MIN_FALLBACK_LENGTH = 9
+MAX_DATE_LENGTH = 64
+
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12
+}
+MONTH_PATTERN = r'(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?'
+TIME_PATTERN = r'(?:[ t](\d{1,2}):(\d{2})(?::(\d{2}))?(?:\.\d+)?)?'
+
+ISO_DATE = re.compile(r'(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})' + TIME_PATTERN + r'(z|[+-]\d{2}:?\d{2})?')
+NUMERIC_DATE = re.compile(r'(\d{1,2})([-/.])(\d{1,2})\2(\d{4}|\d{2})' + TIME_PATTERN)
+DAY_MONTH_YEAR = re.compile(r'(\d{1,2})(?:st|nd|rd|th)?[ -]' + MONTH_PATTERN + r',?[ -](\d{4})' + TIME_PATTERN)
+MONTH_DAY_YEAR = re.compile(MONTH_PATTERN + r' (\d{1,2})(?:st|nd|rd|th)?,? (\d{4})' + TIME_PATTERN)
+DATE_LIKE = re.compile(r'\d{1,4}[-/.]\d{1,2}|\b' + MONTH_PATTERN + r'\b|\b\d{4}\b')
+VERSION_LIKE = re.compile(r'v?\d{1,3}(\.\d{1,3}){1,3}')
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_date(text):
+    text = ' '.join(text.split()).lower()
+    if not text or len(text) > MAX_DATE_LENGTH or not any(c.isdigit() for c in text):
+        return None
+    if VERSION_LIKE.fullmatch(text):
+        return None
+
+    parsed = parse_date_fast(text)
+    if parsed is not None:
+        return parsed
+    if len(text) < MIN_FALLBACK_LENGTH or not DATE_LIKE.search(text):
+        return None
+
+    try:
+        parsed = dateparser.parse(text, settings={'TIMEZONE': 'UTC'})
+    except Exception as e:
+        logger.debug(f'dateparser failed on "{text}": {e}')
+        return None
+    return to_naive_utc(parsed) if parsed else None
+
+
+def parse_date_fast(text):
+    if match := ISO_DATE.fullmatch(text):
+        year, month, day, hour, minute, second, offset = match.groups()
+        parsed = build_datetime(year, month, day, hour, minute, second)
+        if parsed and offset:
+            parsed = apply_offset(parsed, offset)
+        return parsed
+
+    if match := NUMERIC_DATE.fullmatch(text):
+        first, separator, second_part, year, hour, minute, second = match.groups()
+        first, second_part = int(first), int(second_part)
+        if separator == '.':
+            day, month = (second_part, first) if second_part > 12 else (first, second_part)
+        else:
+            day, month = (first, second_part) if first > 12 else (second_part, first)
+        if len(year) == 2:
+            year = 2000 + int(year) if int(year) < 70 else 1900 + int(year)
+        return build_datetime(year, month, day, hour, minute, second)
+
+    if match := DAY_MONTH_YEAR.fullmatch(text):
+        day, month, year, hour, minute, second = match.groups()
+        return build_datetime(year, MONTHS[month], day, hour, minute, second)
+
+    if match := MONTH_DAY_YEAR.fullmatch(text):
+        month, day, year, hour, minute, second = match.groups()
+        return build_datetime(year, MONTHS[month], day, hour, minute, second)
+    return None
+
+
+def build_datetime(year, month, day, hour=None, minute=None, second=None):
+    try:
+        return datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0))
+    except ValueError:
+        return None
+
+
+def apply_offset(parsed, offset):
+    if offset == 'z':
+        return parsed
+    offset = offset.replace(':', '')
+    aware = datetime.strptime(f'{parsed.isoformat()}{offset}', '%Y-%m-%dT%H:%M:%S%z')
+    return to_naive_utc(aware)
+
+
+def to_naive_utc(dt):
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
@@ -1,10 +1,9 @@
-import dateparser
 from docx import Document
 from dotenv import load_dotenv
+from ingestion.utils.date_utils import parse_date
 import logging
 import os
 import pytz
-import re
 
 logger = logging.getLogger(__name__)
 
@@ -32,14 +31,15 @@ def get_prds(path=PRD_PATH):
 
 
 def extract_date_from_document(doc_path):
+    return extract_dates(Document(doc_path))
+
+
+def extract_dates(doc):
     parsed_dates = []
-    doc = Document(doc_path)
     for table in doc.tables:
         for row in table.rows:
             for cell in row.cells:
-                parsed = None
-                if len(cell.text) > 8 or re.fullmatch(cell.text, '/d+(/./d+)+'):
-                    parsed = dateparser.parse(cell.text, settings={'TIMEZONE': 'UTC'})   
+                parsed = parse_date(cell.text)
                 if parsed:
                     parsed_dates.append(parsed)
         if parsed_dates:
@@ -52,5 +52,20 @@ def extract_date_from_document(doc_path):
 
 
 def extract_text_from_docx(path):
+    return extract_text(Document(path))
+
+
+def extract_text(doc):
+    return "\n".join([para.text for para in doc.paragraphs if para.text.strip()])
+
+
+def parse_prd(name, path):
     doc = Document(path)
-    return "\n".join([para.text for para in doc.paragraphs if para.text.strip()])
\ No newline at end of file
+    created_at, updated_at = extract_dates(doc)
+    return {
+        'title': name,
+        'page_id': name,
+        'created_at': created_at,
+        'updated_at': updated_at,
+        'text': extract_text(doc)
+    }
\ No newline at end of file
@@ -0,0 +1,87 @@
+from dotenv import load_dotenv
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+MANIFEST_PATH = os.getenv('SYNC_MANIFEST_PATH') or os.path.join(os.getenv('VECTOR_DB_DIRECTORY') or '.', 'sync_manifest.json')
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def get_manifest(path=MANIFEST_PATH):
+    with _manifests_lock:
+        manifest = _manifests.get(path)
+        if manifest is None:
+            manifest = SyncManifest(path)
+            _manifests[path] = manifest
+        return manifest
+
+
+def hash_content(content):
+    return hashlib.sha256((content or '').encode('utf-8')).hexdigest()
+
+
+class SyncManifest:
+    def __init__(self, path):
+        self.path = path
+        self.pages = {}
+        self._lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            logger.info(f'No sync manifest at {self.path}, starting a full sync')
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.pages = json.load(f).get('pages', {})
+            logger.info(f'Loaded sync manifest with {len(self.pages)} pages from {self.path}')
+        except (OSError, ValueError) as e:
+            logger.exception(f'Could not read sync manifest {self.path}, starting a full sync: {e}')
+            self.pages = {}
+
+    def save(self):
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'pages': self.pages}, f)
+            os.replace(tmp_path, self.path)
+
+    def get(self, page_id):
+        with self._lock:
+            return self.pages.get(str(page_id))
+
+    def is_unchanged(self, page_id, version, content_hash=None):
+        entry = self.get(page_id)
+        if not entry or version is None or entry.get('version') != version:
+            return False
+        return content_hash is None or entry.get('content_hash') == content_hash
+
+    def update(self, page_id, version, updated_at, content_hash, chunk_ids, root=None, linked_pages=None):
+        with self._lock:
+            self.pages[str(page_id)] = {
+                'version': version,
+                'updated_at': updated_at,
+                'content_hash': content_hash,
+                'chunk_ids': list(chunk_ids),
+                'root': root,
+                'linked_pages': [list(link) for link in linked_pages or []]
+            }
+
+    def remove(self, page_id):
+        with self._lock:
+            return self.pages.pop(str(page_id), None)
+
+    def pages_under_root(self, root):
+        with self._lock:
+            return [page_id for page_id, entry in self.pages.items() if entry.get('root') == root]
@@ -0,0 +1,140 @@
+from html.entities import html5
+from html.parser import HTMLParser
+
+PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+NON_TEXT_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
+VOID_TAGS = {'area', 'base', 'basefont', 'bgsound', 'br', 'col', 'command', 'embed', 'frame', 'hr', 'image', 'img',
+             'input', 'isindex', 'keygen', 'link', 'menuitem', 'meta', 'nextid', 'param', 'source', 'spacer', 'track',
+             'wbr'}
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+
+class StorageFormatExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.strings = []
+        self.pdfs = []
+        self.linked_pages = []
+        self._data = []
+        self._open_tags = []
+        self._open_counts = {}
+        self._preserve_depth = 0
+        self._non_text_depth = 0
+        self._closed_void_tags = []
+
+    def handle_starttag(self, tag, attrs, close_void=True):
+        self._flush()
+        self._push(tag)
+
+        if tag == 'ri:attachment':
+            attrs = dict(attrs)
+            if 'ri:filename' in attrs:
+                filename = (attrs['ri:filename'] or '').lower()
+                if filename.endswith('.pdf'):
+                    self.pdfs.append(filename)
+        elif tag == 'ri:page':
+            attrs = dict(attrs)
+            title = attrs.get('ri:content-title') or attrs.get('ri:page-id') or 'Untitled'
+            space = attrs.get('ri:space-key')
+            self.linked_pages.append((space or 'Unknown', title))
+
+        if close_void and tag in VOID_TAGS:
+            self._pop_to(tag)
+            self._closed_void_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self._closed_void_tags:
+            self._closed_void_tags.remove(tag)
+            return
+        self._flush()
+        self._pop_to(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, close_void=False)
+        self.handle_endtag(tag)
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    def handle_charref(self, name):
+        if name[:1] in ('x', 'X'):
+            codepoint = int(name.lstrip('xX'), 16)
+        else:
+            codepoint = int(name)
+        data = None
+        if codepoint < 256:
+            try:
+                data = bytes([codepoint]).decode('windows-1252')
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = chr(codepoint)
+            except (ValueError, OverflowError):
+                pass
+        self.handle_data(data or '\N{REPLACEMENT CHARACTER}')
+
+    def handle_entityref(self, name):
+        character = html5.get(f'{name};')
+        self.handle_data(character if character is not None else f'&{name}')
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, decl):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def unknown_decl(self, data):
+        self._flush()
+        if data.upper().startswith('CDATA['):
+            self._data.append(data[len('CDATA['):])
+            self._flush(cdata=True)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+    def _flush(self, cdata=False):
+        if not self._data:
+            return
+        text = ''.join(self._data)
+        self._data = []
+        if not self._preserve_depth and not text.strip(ASCII_SPACES):
+            text = '\n' if '\n' in text else ' '
+        if cdata or not self._non_text_depth:
+            self.strings.append(text)
+
+    def _push(self, tag):
+        self._open_tags.append(tag)
+        self._open_counts[tag] = self._open_counts.get(tag, 0) + 1
+        if tag in PRESERVE_WHITESPACE_TAGS:
+            self._preserve_depth += 1
+        if tag in NON_TEXT_TAGS:
+            self._non_text_depth += 1
+
+    def _pop_to(self, tag):
+        if not self._open_counts.get(tag):
+            return
+        while True:
+            popped = self._open_tags.pop()
+            self._open_counts[popped] -= 1
+            if popped in PRESERVE_WHITESPACE_TAGS:
+                self._preserve_depth -= 1
+            if popped in NON_TEXT_TAGS:
+                self._non_text_depth -= 1
+            if popped == tag:
+                return
+
+
+def extract_storage_content(body):
+    extractor = StorageFormatExtractor()
+    extractor.feed(body)
+    extractor.close()
+    return {
+        'text': '\n'.join(extractor.strings).strip(),
+        'pdfs': extractor.pdfs,
+        'linked_pages': extractor.linked_pages
+    }
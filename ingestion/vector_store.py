@@ -0,0 +1,57 @@
+import argparse
+from dotenv import load_dotenv
+import logging
+import os
+from utils.db_utils import DB_PATH, get_collection
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+VECTOR_COPY_BATCH_SIZE = int(os.getenv('VECTOR_COPY_BATCH_SIZE', 1000))
+BACKENDS = ('chroma', 'numpy')
+
+
+def copy_collection(source, target, db_path=DB_PATH, batch_size=VECTOR_COPY_BATCH_SIZE):
+    if source == target:
+        raise ValueError('Source and target backends must differ')
+    source_collection = get_collection(db_path, backend=source)
+    target_collection = get_collection(db_path, backend=target)
+    total = source_collection.count()
+    copied = 0
+    while copied < total:
+        batch = source_collection.get(limit=batch_size, offset=copied,
+                                      include=['documents', 'metadatas', 'embeddings'])
+        if not batch['ids']:
+            break
+        target_collection.upsert(
+            ids=batch['ids'],
+            documents=batch['documents'],
+            metadatas=batch['metadatas'],
+            embeddings=batch['embeddings']
+        )
+        copied += len(batch['ids'])
+        logger.info(f'Copied {copied}/{total} vectors from {source} to {target}')
+
+    if target_collection.count() < total:
+        logger.warning(f'{target} holds {target_collection.count()} vectors after copying {total} from {source}')
+    return copied
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Copy the prd_docs vectors between the Chroma and numpy backends')
+    parser.add_argument('--source', choices=BACKENDS, default='chroma')
+    parser.add_argument('--target', choices=BACKENDS, default='numpy')
+    parser.add_argument('--db-path', default=DB_PATH, help='Vector store directory, defaults to VECTOR_DB_DIRECTORY')
+    parser.add_argument('--batch-size', type=int, default=VECTOR_COPY_BATCH_SIZE)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    copy_collection(args.source, args.target, db_path=args.db_path, batch_size=args.batch_size)
@@ -0,0 +1,173 @@
+import threading
+import time
+import pytest
+from ingestion.utils import confluence_utils
+from ingestion.utils.confluence_utils import PageSync, chunk_page, download_attachments
+from ingestion.utils.manifest_utils import SyncManifest
+from utils import text_utils
+
+
+class FakeWriter:
+    def __init__(self):
+        self.on_flush = None
+        self.pending = []
+        self.flushes = 0
+
+    def add(self, page, chunk_idx, chunk, doc_id, embedding, pdf=''):
+        self.pending.append(doc_id)
+
+    def add_duplicate(self, page, chunk_idx, chunk, doc_id, pdf=''):
+        return None
+
+    def flush(self):
+        self.flushes += 1
+        self.pending = []
+        self.on_flush(False)
+
+    def fail_flush(self):
+        self.pending = []
+        self.on_flush(True)
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = SyncManifest(str(tmp_path / 'manifest.json'))
+    manifest.update('1', 1, '', 'old', ['1--chunk-0', '1--chunk-1', '1--pdf-a.pdf--chunk-0'])
+    return manifest
+
+
+@pytest.fixture
+def deleted(monkeypatch):
+    deleted = []
+    monkeypatch.setattr(confluence_utils, 'delete_docs', lambda ids: deleted.extend(ids))
+    return deleted
+
+
+def sync_page(sync, page):
+    for item in chunk_page(page, sync):
+        sync.write(item, [0.1, 0.2])
+
+
+def make_page(**kwargs):
+    page = {'page_id': '1', 'title': 'Page', 'text': 'Some page text.', 'pdfs': [], 'version': 2,
+            'content_hash': 'new'}
+    page.update(kwargs)
+    return page
+
+
+def test_skipped_attachment_keeps_previous_chunks(monkeypatch, manifest, deleted):
+    monkeypatch.setattr(confluence_utils, 'download_attachments',
+                        lambda page_id, safe_title, pdfs: iter([(pdf, None) for pdf in pdfs]))
+    writer = FakeWriter()
+    sync = PageSync(writer, manifest)
+    sync_page(sync, make_page(pdfs=['a.pdf']))
+    writer.flush()
+
+    entry = manifest.get('1')
+    assert entry['version'] is None
+    assert '1--pdf-a.pdf--chunk-0' in entry['chunk_ids']
+    assert deleted == []
+
+
+def test_stale_chunks_are_deleted_after_a_flush(manifest, deleted):
+    writer = FakeWriter()
+    sync = PageSync(writer, manifest)
+    sync_page(sync, make_page())
+
+    assert writer.flushes == 1
+    assert sorted(deleted) == ['1--chunk-1', '1--pdf-a.pdf--chunk-0']
+    assert manifest.get('1')['version'] == 2
+    assert manifest.get('1')['chunk_ids'] == ['1--chunk-0']
+
+
+def test_manifest_waits_for_the_next_flush(manifest, deleted):
+    writer = FakeWriter()
+    sync = PageSync(writer, manifest)
+    sync_page(sync, make_page(page_id='2'))
+    assert writer.flushes == 0
+    assert manifest.get('2') is None
+
+    writer.flush()
+    assert manifest.get('2')['version'] == 2
+
+
+def test_failed_flush_leaves_pages_to_retry(manifest, deleted):
+    writer = FakeWriter()
+    sync = PageSync(writer, manifest)
+    sync_page(sync, make_page(page_id='2'))
+    writer.fail_flush()
+    writer.flush()
+    assert manifest.get('2') is None
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        time.sleep(0.05)
+        yield self.data
+
+
+class FakeClient:
+    def __init__(self):
+        self.urls = []
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        with self._lock:
+            self.urls.append(url)
+        return FakeResponse(b'%PDF-1.4')
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    client = FakeClient()
+    attachments = {
+        'a.pdf': {'id': 'att1', 'version': {'number': 1}, '_links': {'download': '/download/a.pdf'}},
+        'b.pdf': {'id': 'att2', 'version': {'number': 1}, '_links': {'download': '/download/b.pdf'}}
+    }
+    monkeypatch.setattr(confluence_utils, 'get_client', lambda: client)
+    monkeypatch.setattr(confluence_utils, 'get_attachments', lambda page_id: attachments)
+    monkeypatch.setattr(confluence_utils, 'BASE_URL', 'https://confluence')
+    monkeypatch.setattr(confluence_utils, 'BASE_DOWNLOAD_PATH', str(tmp_path))
+    return client
+
+
+def test_duplicate_filenames_download_once(client, tmp_path):
+    results = list(download_attachments('1', 'Page', ['a.pdf', 'b.pdf', 'a.pdf']))
+
+    assert [filename for filename, _ in results] == ['a.pdf', 'b.pdf']
+    assert all(path for _, path in results)
+    assert sorted(client.urls) == ['https://confluence/download/a.pdf', 'https://confluence/download/b.pdf']
+    assert not list(tmp_path.rglob('*.part'))
+
+
+def test_downloads_are_keyed_by_attachment(client, tmp_path):
+    [(_, path)] = download_attachments('1', 'Page', ['a.pdf'])
+    assert path == str(tmp_path / 'Page' / 'pdfs' / 'att1' / 'a.pdf')
+    list(download_attachments('1', 'Page', ['a.pdf']))
+    assert len(client.urls) == 1
+
+
+def test_page_without_extractable_text_is_recorded(monkeypatch, manifest, deleted):
+    monkeypatch.setattr(confluence_utils, 'download_attachments',
+                        lambda page_id, safe_title, pdfs: iter([(pdf, f'/tmp/{pdf}') for pdf in pdfs]))
+    monkeypatch.setattr(text_utils, 'iter_pdf_pages', lambda path: iter(['', '  ']))
+    writer = FakeWriter()
+    sync = PageSync(writer, manifest)
+    sync_page(sync, make_page(page_id='3', text='', pdfs=['scan.pdf']))
+    writer.flush()
+
+    entry = manifest.get('3')
+    assert entry['version'] == 2
+    assert entry['chunk_ids'] == []
@@ -0,0 +1,14 @@
+from datetime import datetime
+from ingestion.utils.date_utils import parse_date
+
+
+def test_version_strings_are_not_dates():
+    for text in ('1.2.10', '1.1.20', 'v2.3', '1.2.3.4', '10.4'):
+        assert parse_date(text) is None, text
+
+
+def test_numeric_dates_still_parse():
+    assert parse_date('01.02.2024') == datetime(2024, 2, 1)
+    assert parse_date('12/03/24') == datetime(2024, 12, 3)
+    assert parse_date('2024-01-02T10:30:00Z') == datetime(2024, 1, 2, 10, 30)
+    assert parse_date('3 Jan 2024') == datetime(2024, 1, 3)
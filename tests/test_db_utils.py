@@ -0,0 +1,50 @@
+import pytest
+from utils import db_utils
+from utils.db_utils import BulkWriter
+
+
+class FakeCollection:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batches = []
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        if self.fail:
+            raise RuntimeError('write failed')
+        self.batches.append(list(ids))
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    collection = FakeCollection()
+    monkeypatch.setattr(db_utils, 'get_collection', lambda db_path=None, backend=None: collection)
+    monkeypatch.setattr(db_utils, 'get_lexical_index', lambda: None)
+    return collection
+
+
+def add_chunks(writer, count, page_id='1'):
+    for n in range(count):
+        writer.add({'page_id': page_id, 'title': 'Page'}, n, f'chunk {n}', f'{page_id}--chunk-{n}', [0.1, 0.2])
+
+
+def test_bulk_writer_writes_full_batches(collection):
+    with BulkWriter(batch_size=3, dedup=False) as writer:
+        add_chunks(writer, 7)
+        assert [len(batch) for batch in collection.batches] == [3, 3]
+    assert [len(batch) for batch in collection.batches] == [3, 3, 1]
+    assert writer.written == 7
+
+
+def test_bulk_writer_reports_flushes(collection):
+    flushes = []
+    writer = BulkWriter(batch_size=2, dedup=False, on_flush=flushes.append)
+    add_chunks(writer, 3)
+    writer.flush()
+    assert flushes == [False, False]
+
+    collection.fail = True
+    add_chunks(writer, 1, page_id='2')
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    assert flushes == [False, False, True]
+    assert writer.ids == []
@@ -0,0 +1,109 @@
+import threading
+import time
+import pytest
+from utils import ollama_utils
+from utils.ollama_utils import EMBEDDING_MAX_LENGTH, complete, embed_batch, set_chat_parallelism, set_keep_alive
+
+
+class FakeEmbed:
+    def __init__(self, fail_batches=False, bad_texts=()):
+        self.fail_batches = fail_batches
+        self.bad_texts = set(bad_texts)
+        self.calls = []
+
+    def __call__(self, model, input, keep_alive=None):
+        self.calls.append(input)
+        texts = input if isinstance(input, list) else [input]
+        if isinstance(input, list) and self.fail_batches:
+            raise RuntimeError('batch failed')
+        if any(text in self.bad_texts for text in texts):
+            raise RuntimeError('bad text')
+        return {'embeddings': [[float(len(text))] for text in texts]}
+
+
+@pytest.fixture
+def fake_embed(monkeypatch):
+    def install(**kwargs):
+        fake = FakeEmbed(**kwargs)
+        monkeypatch.setattr(ollama_utils, 'embed', fake)
+        return fake
+    monkeypatch.setattr(ollama_utils, 'get_embedding_cache', lambda: None)
+    return install
+
+
+def test_unembeddable_texts_keep_their_positions(fake_embed):
+    fake = fake_embed()
+    too_long = 'x' * (EMBEDDING_MAX_LENGTH + 1)
+    embeddings = embed_batch(['one', '', too_long, '   ', 'three'])
+
+    assert embeddings == [[3.0], None, None, None, [5.0]]
+    assert fake.calls == [['one', 'three']]
+
+
+def test_failed_batch_falls_back_to_single_texts(fake_embed):
+    fake = fake_embed(fail_batches=True, bad_texts=['bad'])
+    embeddings = embed_batch(['alpha', 'bad', '', 'gamma'])
+
+    assert embeddings == [[5.0], None, None, [5.0]]
+    assert fake.calls == [['alpha', 'bad', 'gamma'], 'alpha', 'bad', 'gamma']
+
+
+def test_short_batch_response_falls_back_to_single_texts(fake_embed, monkeypatch):
+    fake = fake_embed()
+    single = fake.__call__
+
+    def short_batch(model, input, keep_alive=None):
+        if isinstance(input, list):
+            fake.calls.append(input)
+            return {'embeddings': [[1.0]]}
+        return single(model, input, keep_alive)
+
+    monkeypatch.setattr(ollama_utils, 'embed', short_batch)
+    assert embed_batch(['ab', 'abc']) == [[2.0], [3.0]]
+    assert fake.calls == [['ab', 'abc'], 'ab', 'abc']
+
+
+def test_chat_parallelism_caps_concurrent_requests(monkeypatch):
+    lock = threading.Lock()
+    active = [0, 0]
+
+    def fake_chat(**kwargs):
+        with lock:
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return {'message': {'content': 'ok'}}
+
+    monkeypatch.setattr(ollama_utils, 'chat', fake_chat)
+    monkeypatch.setattr(ollama_utils, '_chat_slots', ollama_utils._chat_slots)
+    set_chat_parallelism(2)
+    threads = [threading.Thread(target=complete, args=('prompt', )) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert active[1] == 2
+
+
+def test_keep_alive_reaches_every_request(monkeypatch, fake_embed):
+    fake = fake_embed()
+    seen = []
+
+    def fake_chat(**kwargs):
+        seen.append(kwargs['keep_alive'])
+        return {'message': {'content': 'ok'}}
+
+    def recording_embed(model, input, keep_alive=None):
+        seen.append(keep_alive)
+        return fake(model, input, keep_alive)
+
+    monkeypatch.setattr(ollama_utils, 'chat', fake_chat)
+    monkeypatch.setattr(ollama_utils, 'embed', recording_embed)
+    monkeypatch.setattr(ollama_utils, 'OLLAMA_KEEP_ALIVE', ollama_utils.OLLAMA_KEEP_ALIVE)
+    set_keep_alive(-1.0)
+    complete('prompt')
+    embed_batch(['one', 'two'])
+    ollama_utils.get_embedding('three')
+    assert seen == [-1.0, -1.0, -1.0]
@@ -0,0 +1,122 @@
+from array import array
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH') or os.path.join(os.getenv('VECTOR_DB_DIRECTORY') or '.', 'embedding_cache.sqlite3')
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', 500000))
+SQLITE_MAX_PARAMS = 500
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(path=EMBEDDING_CACHE_PATH):
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            try:
+                cache = EmbeddingCache(path)
+            except sqlite3.Error as e:
+                logger.exception(f'Could not open embedding cache at {path}, caching disabled: {e}')
+                return None
+            _caches[path] = cache
+        return cache
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f'{model}\0{text}'.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            'key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+        self._conn.commit()
+        self._count = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    def get_many(self, model, texts):
+        keys = [cache_key(model, text) for text in texts]
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), SQLITE_MAX_PARAMS):
+                batch = keys[i:i + SQLITE_MAX_PARAMS]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', batch
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany('UPDATE embeddings SET last_used = ? WHERE key = ?',
+                                       [(now, key) for key in found])
+                self._conn.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return [unpack_vector(found[key]) if key in found else None for key in keys]
+
+    def get(self, model, text):
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model, texts, embeddings):
+        now = time.time()
+        rows = [
+            (cache_key(model, text), model, pack_vector(embedding), now)
+            for text, embedding in zip(texts, embeddings)
+            if embedding is not None
+        ]
+        if not rows:
+            return
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)', rows
+            )
+            self._count += self._conn.total_changes - before
+            if self._count > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def put(self, model, text, embedding):
+        self.put_many(model, [text], [embedding])
+
+    def _evict(self):
+        target = int(self.max_entries * 0.9)
+        excess = self._count - target
+        self._conn.execute(
+            'DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)', (excess,)
+        )
+        self._count = target
+        logger.info(f'Evicted {excess} least recently used embeddings from cache')
+
+
+def pack_vector(embedding):
+    return array('f', embedding).tobytes()
+
+
+def unpack_vector(blob):
+    vector = array('f')
+    vector.frombytes(blob)
+    return vector.tolist()
@@ -1,15 +1,38 @@
-import chromadb
 import logging
+import numpy as np
 import os
+import threading
+from utils.dedup_utils import get_dedup_index, hamming_distance, join_page_ids, simhash
+from utils.lexical_utils import get_lexical_index
+from utils.vector_utils import VECTOR_BACKEND, NumpyCollection, numpy_index_directory
 
 logger = logging.getLogger(__name__)
 
 DB_PATH = os.getenv('VECTOR_DB_DIRECTORY')
+COLLECTION_NAME = 'prd_docs'
+DB_WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', 256))
+SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', 0.5))
+RESULTS_PER_QUERY = int(os.getenv('RESULTS_PER_QUERY', 10))
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', 20))
 
-def get_collection(db_path=DB_PATH):
-    db_client = chromadb.PersistentClient(path=db_path)
-    collection = db_client.get_or_create_collection(name='prd_docs')
-    return collection
+_collections = {}
+_collections_lock = threading.Lock()
+
+
+def get_collection(db_path=DB_PATH, backend=VECTOR_BACKEND):
+    with _collections_lock:
+        collection = _collections.get((backend, db_path))
+        if collection is None:
+            if backend == 'numpy':
+                collection = NumpyCollection(numpy_index_directory(db_path))
+            elif backend == 'chroma':
+                import chromadb
+                db_client = chromadb.PersistentClient(path=db_path)
+                collection = db_client.get_or_create_collection(name=COLLECTION_NAME)
+            else:
+                raise ValueError(f'Unknown VECTOR_BACKEND {backend}, expected chroma or numpy')
+            _collections[(backend, db_path)] = collection
+        return collection
 
 
 def create_metadata_for_embedded_chunks(page, chunk_index, pdf=''):
@@ -31,43 +54,272 @@ def create_metadata_for_embedded_chunks(page, chunk_index, pdf=''):
     return metadata
 
 
-def load_data_to_db(page, chunk_idx, chunk, doc_id, embedding, pdf):
-        metadata = create_metadata_for_embedded_chunks(page, chunk_idx, pdf=pdf)
-        doc_collection = get_collection()
-        doc_collection.add(
-        documents=[chunk],
+def delete_docs(ids, db_path=DB_PATH):
+    if not ids:
+        return
+    if dedup := get_dedup_index():
+        release_duplicates(dedup, ids, db_path=db_path)
+    collection = get_collection(db_path)
+    collection.delete(ids=list(ids))
+    logger.info(f'Deleted {len(ids)} stale chunks from {COLLECTION_NAME}')
+    delete_lexical_docs(ids)
+
+
+def delete_lexical_docs(ids):
+    if index := get_lexical_index():
+        try:
+            index.delete(ids)
+        except Exception as e:
+            logger.exception(f'Could not delete {len(ids)} chunks from the lexical index: {e}')
+
+
+def release_duplicates(dedup, ids, db_path=DB_PATH):
+    ids = set(ids)
+    touched = set()
+    for doc_id in ids:
+        entry = dedup.get(doc_id)
+        if not entry:
+            continue
+        if entry['canonical_id'] == doc_id:
+            rehome_group(dedup, doc_id, exclude=ids, db_path=db_path)
+        else:
+            touched.add(entry['canonical_id'])
+    dedup.remove(ids)
+    refresh_source_page_ids(dedup, touched - ids, db_path=db_path)
+
+
+def rehome_group(dedup, canonical_id, exclude=(), db_path=DB_PATH):
+    members = [entry for entry in dedup.members(canonical_id)
+               if entry['doc_id'] != canonical_id and entry['doc_id'] not in exclude]
+    if not members:
+        return None
+    collection = get_collection(db_path)
+    result = collection.get(ids=[canonical_id], include=['documents', 'metadatas', 'embeddings'])
+    if not result.get('ids'):
+        logger.warning(f'Chunk {canonical_id} is missing from {COLLECTION_NAME}, '
+                       f'dropping {len(members)} near-duplicates that pointed at it')
+        dedup.remove(entry['doc_id'] for entry in members)
+        return None
+
+    home = members[0]
+    metadata = dict(home['metadata'] or result['metadatas'][0] or {})
+    metadata['source_page_ids'] = join_page_ids(entry['page_id'] for entry in members)
+    collection.upsert(
+        ids=[home['doc_id']],
+        documents=result['documents'],
         metadatas=[metadata],
-        ids=[doc_id],
-        embeddings=[embedding]
+        embeddings=[list(result['embeddings'][0])]
+    )
+    dedup.move_group(canonical_id, home['doc_id'])
+    if index := get_lexical_index():
+        try:
+            index.upsert([home['doc_id']], result['documents'])
+        except Exception as e:
+            logger.exception(f'Could not add chunk {home["doc_id"]} to the lexical index: {e}')
+    logger.debug(f'Moved {len(members)} near-duplicates of {canonical_id} to {home["doc_id"]}')
+    return home['doc_id']
+
+
+def refresh_source_page_ids(dedup, canonical_ids, db_path=DB_PATH):
+    canonical_ids = sorted(canonical_ids)
+    if not canonical_ids:
+        return
+    get_collection(db_path).update(
+        ids=canonical_ids,
+        metadatas=[{'source_page_ids': dedup.source_page_ids(id)} for id in canonical_ids]
     )
 
 
-def perform_similarity_search(embedding):
+def get_docs(ids, db_path=DB_PATH):
+    if not ids:
+        return {}
+    result = get_collection(db_path).get(ids=list(ids), include=['documents', 'metadatas'])
+    return {
+        id: {'id': id, 'document': document, 'metadata': metadata}
+        for id, document, metadata in zip(result.get('ids') or [], result.get('documents') or [],
+                                          result.get('metadatas') or [])
+    }
+
+
+class BulkWriter:
+    def __init__(self, batch_size=DB_WRITE_BATCH_SIZE, upsert=True, db_path=DB_PATH, dedup=True, on_flush=None):
+        self.batch_size = batch_size
+        self.upsert = upsert
+        self.db_path = db_path
+        self.on_flush = on_flush
+        self.dedup = get_dedup_index() if dedup else None
+        self.written = 0
+        self.duplicates = 0
+        self._touched = set()
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.documents = []
+        self.metadatas = []
+        self.ids = []
+        self.embeddings = []
+
+    def add(self, page, chunk_idx, chunk, doc_id, embedding, pdf=''):
+        fingerprint = simhash(chunk) if self.dedup else None
+        metadata = create_metadata_for_embedded_chunks(page, chunk_idx, pdf=pdf)
+        with self._lock:
+            if self._add_duplicate(page, doc_id, fingerprint, metadata):
+                return
+            if self.dedup:
+                self._detach(doc_id, fingerprint)
+                if fingerprint is None:
+                    self.dedup.remove([doc_id])
+                else:
+                    self.dedup.add(doc_id, page.get('page_id'), fingerprint, doc_id, metadata)
+                    metadata['source_page_ids'] = join_page_ids([page.get('page_id')])
+            self.documents.append(chunk)
+            self.metadatas.append(metadata)
+            self.ids.append(doc_id)
+            self.embeddings.append(embedding)
+            if len(self.ids) >= self.batch_size:
+                self._flush()
+
+    def add_duplicate(self, page, chunk_idx, chunk, doc_id, pdf=''):
+        if not self.dedup:
+            return None
+        fingerprint = simhash(chunk)
+        if fingerprint is None:
+            return None
+        metadata = create_metadata_for_embedded_chunks(page, chunk_idx, pdf=pdf)
+        with self._lock:
+            return self._add_duplicate(page, doc_id, fingerprint, metadata)
+
+    def _add_duplicate(self, page, doc_id, fingerprint, metadata):
+        if fingerprint is None:
+            return None
+        canonical_id = self.dedup.find(fingerprint, exclude_id=doc_id)
+        if canonical_id is None:
+            return None
+        if self._detach(doc_id):
+            get_collection(self.db_path).delete(ids=[doc_id])
+            delete_lexical_docs([doc_id])
+        self.dedup.add(doc_id, page.get('page_id'), fingerprint, canonical_id, metadata)
+        self._touched.add(canonical_id)
+        self.duplicates += 1
+        return canonical_id
+
+    def _detach(self, doc_id, fingerprint=None):
+        entry = self.dedup.get(doc_id)
+        if not entry:
+            return False
+        if entry['canonical_id'] != doc_id:
+            self._touched.add(entry['canonical_id'])
+            return False
+        if (fingerprint is not None and entry['fingerprint'] is not None
+                and hamming_distance(fingerprint, entry['fingerprint']) <= self.dedup.max_distance):
+            self._touched.add(doc_id)
+            return False
+        self._flush()
+        rehome_group(self.dedup, doc_id, db_path=self.db_path)
+        return True
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.ids:
+            self._refresh_sources()
+            self._notify()
+            return
+        collection = get_collection(self.db_path)
+        write = collection.upsert if self.upsert else collection.add
+        try:
+            write(
+                documents=self.documents,
+                metadatas=self.metadatas,
+                ids=self.ids,
+                embeddings=self.embeddings
+            )
+            self.written += len(self.ids)
+            logger.debug(f'Wrote {len(self.ids)} chunks to {COLLECTION_NAME}')
+            if index := get_lexical_index():
+                try:
+                    index.upsert(self.ids, self.documents)
+                except Exception as e:
+                    logger.exception(f'Could not add {len(self.ids)} chunks to the lexical index: {e}')
+        except Exception:
+            if self.dedup:
+                self.dedup.remove(self.ids)
+            self._notify(failed=True)
+            raise
+        finally:
+            self._reset()
+        self._refresh_sources()
+        self._notify()
+
+    def _notify(self, failed=False):
+        if self.on_flush:
+            self.on_flush(failed)
+
+    def _refresh_sources(self):
+        if not self._touched:
+            return
+        touched, self._touched = self._touched, set()
+        refresh_source_page_ids(self.dedup, touched, db_path=self.db_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        if self.duplicates:
+            logger.info(f'Stored {self.duplicates} near-duplicate chunks as references instead of new embeddings')
+        if index := get_lexical_index():
+            index.compact_if_dirty()
+
+
+def perform_batch_similarity_search(embeddings, n_results=RESULTS_PER_QUERY):
     collection = get_collection()
     result = collection.query(
-        query_embeddings=[embedding],
-        n_results=10,
+        query_embeddings=embeddings,
+        n_results=n_results,
         include=['documents', 'metadatas', 'distances']
     )
     return result
 
 
-def get_similar_docs(embedding):
-    result = perform_similarity_search(embedding)
-    try:
-        filtered_docs = {}
-        ids = result.get('ids')
-        distances = result.get('distances')
-        documents = result.get('documents')
-        if documents:
-            for id, doc, dist in zip(ids[0], documents[0], distances[0]):
-                if dist < 0.5:
-                    filtered_docs[id] = doc
-        logger.info(f'Found {len(filtered_docs.keys())} similar docs')
-    except Exception as e:
-        logger.exception(f'Error while fetching similar docs : {str(e)}')
-    return filtered_docs
-
+def rank_similar_docs(embeddings, top_k=RETRIEVAL_TOP_K, n_results=RESULTS_PER_QUERY, threshold=SIMILARITY_THRESHOLD):
+    embeddings = [e for e in embeddings if e is not None]
+    if not embeddings:
+        return []
 
+    result = perform_batch_similarity_search(embeddings, n_results=n_results)
+    ids = [id for query_ids in result.get('ids') or [] for id in query_ids]
+    if not ids:
+        return []
+    distances = np.fromiter((d for query_distances in result['distances'] for d in query_distances),
+                            dtype=np.float32, count=len(ids))
+    documents = [doc for query_docs in result.get('documents') or [] for doc in query_docs]
+    metadatas = [meta for query_metas in result.get('metadatas') or [] for meta in query_metas]
 
+    keep = np.flatnonzero(distances < threshold)
+    if not keep.size:
+        logger.info('Found 0 similar docs')
+        return []
+    unique_ids, first_index, inverse = np.unique(np.asarray(ids, dtype=object)[keep].astype(str),
+                                                 return_index=True, return_inverse=True)
+    best_distance = np.full(len(unique_ids), np.inf, dtype=np.float32)
+    np.minimum.at(best_distance, inverse, distances[keep])
+    score = np.zeros(len(unique_ids), dtype=np.float32)
+    np.add.at(score, inverse, 1.0 - distances[keep] / threshold)
 
+    order = np.lexsort((best_distance, -score))[:top_k]
+    ranked = []
+    for i in order:
+        source = keep[first_index[i]]
+        ranked.append({
+            'id': unique_ids[i],
+            'document': documents[source] if documents else None,
+            'metadata': metadatas[source] if metadatas else None,
+            'distance': float(best_distance[i]),
+            'score': float(score[i])
+        })
+    logger.info(f'Found {len(unique_ids)} similar docs across {len(embeddings)} queries, keeping {len(ranked)}')
+    return ranked
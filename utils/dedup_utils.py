@@ -0,0 +1,188 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+DEDUP_PATH = os.getenv('DEDUP_PATH') or os.path.join(os.getenv('VECTOR_DB_DIRECTORY') or '.', 'dedup.sqlite3')
+DEDUP_MAX_DISTANCE = int(os.getenv('DEDUP_MAX_DISTANCE', 6))
+DEDUP_MIN_WORDS = int(os.getenv('DEDUP_MIN_WORDS', 8))
+SHINGLE_SIZE = 3
+SIMHASH_BITS = 64
+SQLITE_MAX_PARAMS = 500
+
+WORD_PATTERN = re.compile(r'\w+')
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_dedup_index(path=DEDUP_PATH):
+    if not DEDUP_ENABLED:
+        return None
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            try:
+                index = DedupIndex(path)
+            except sqlite3.Error as e:
+                logger.exception(f'Could not open dedup index at {path}, duplicate detection disabled: {e}')
+                return None
+            _indexes[path] = index
+        return index
+
+
+def simhash(text):
+    words = WORD_PATTERN.findall((text or '').lower())
+    if len(words) < DEDUP_MIN_WORDS:
+        return None
+    shingles = {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+                       for shingle in shingles], dtype=np.uint64)
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    fingerprint = np.packbits(bits.sum(axis=0) * 2 > len(hashes), bitorder='little')
+    return to_signed(int.from_bytes(fingerprint.tobytes(), 'little'))
+
+
+def to_signed(value):
+    return value - (1 << SIMHASH_BITS) if value >= 1 << (SIMHASH_BITS - 1) else value
+
+
+def bands(fingerprint, band_count):
+    value = fingerprint & ((1 << SIMHASH_BITS) - 1)
+    band_bits = SIMHASH_BITS // band_count
+    mask = (1 << band_bits) - 1
+    return [(band, (value >> (band * band_bits)) & mask) for band in range(band_count)]
+
+
+def hamming_distance(a, b):
+    return bin((a ^ b) & ((1 << SIMHASH_BITS) - 1)).count('1')
+
+
+class DedupIndex:
+    def __init__(self, path, max_distance=DEDUP_MAX_DISTANCE):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_distance = max_distance
+        self.band_count = max_distance + 1
+        self.lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS chunks ('
+            'doc_id TEXT PRIMARY KEY, page_id TEXT, fingerprint INTEGER, canonical_id TEXT NOT NULL, metadata TEXT)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS chunks_canonical_id ON chunks (canonical_id)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS bands ('
+            'band INTEGER NOT NULL, value INTEGER NOT NULL, doc_id TEXT NOT NULL, PRIMARY KEY (band, value, doc_id))'
+            ' WITHOUT ROWID'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS bands_doc_id ON bands (doc_id)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)')
+        row = self._conn.execute("SELECT value FROM settings WHERE key = 'band_count'").fetchone()
+        if not row or int(row[0]) != self.band_count:
+            self._rebuild_bands()
+        self._conn.commit()
+
+    def _rebuild_bands(self):
+        self._conn.execute('DELETE FROM bands')
+        rows = self._conn.execute('SELECT doc_id, fingerprint FROM chunks '
+                                  'WHERE canonical_id = doc_id AND fingerprint IS NOT NULL').fetchall()
+        self._conn.executemany('INSERT OR IGNORE INTO bands (band, value, doc_id) VALUES (?, ?, ?)',
+                               [(band, value, doc_id) for doc_id, fingerprint in rows
+                                for band, value in bands(fingerprint, self.band_count)])
+        self._conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('band_count', ?)",
+                           (str(self.band_count),))
+        if rows:
+            logger.info(f'Rebuilt near-duplicate bands for {len(rows)} chunks')
+
+    def find(self, fingerprint, exclude_id=None):
+        if fingerprint is None:
+            return None
+        conditions = ' OR '.join(['(b.band = ? AND b.value = ?)'] * self.band_count)
+        params = [part for band in bands(fingerprint, self.band_count) for part in band]
+        with self.lock:
+            rows = self._conn.execute(
+                'SELECT DISTINCT c.doc_id, c.fingerprint FROM bands b JOIN chunks c ON c.doc_id = b.doc_id '
+                f'WHERE ({conditions}) AND c.canonical_id = c.doc_id AND c.fingerprint IS NOT NULL', params
+            ).fetchall()
+        best = None
+        for doc_id, candidate in sorted(rows):
+            if doc_id == exclude_id:
+                continue
+            distance = hamming_distance(fingerprint, candidate)
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, doc_id)
+        return best[1] if best else None
+
+    def get(self, doc_id):
+        with self.lock:
+            row = self._conn.execute('SELECT doc_id, page_id, fingerprint, canonical_id, metadata FROM chunks '
+                                     'WHERE doc_id = ?', (doc_id,)).fetchone()
+        return to_entry(row) if row else None
+
+    def members(self, canonical_id):
+        with self.lock:
+            rows = self._conn.execute('SELECT doc_id, page_id, fingerprint, canonical_id, metadata FROM chunks '
+                                      'WHERE canonical_id = ? ORDER BY doc_id', (canonical_id,)).fetchall()
+        return [to_entry(row) for row in rows]
+
+    def source_page_ids(self, canonical_id):
+        return join_page_ids(entry['page_id'] for entry in self.members(canonical_id))
+
+    def add(self, doc_id, page_id, fingerprint, canonical_id, metadata=None):
+        with self.lock:
+            self._conn.execute('DELETE FROM bands WHERE doc_id = ?', (doc_id,))
+            self._conn.execute('INSERT OR REPLACE INTO chunks (doc_id, page_id, fingerprint, canonical_id, metadata) '
+                               'VALUES (?, ?, ?, ?, ?)',
+                               (doc_id, page_id, fingerprint, canonical_id, json.dumps(metadata or {})))
+            if fingerprint is not None and canonical_id == doc_id:
+                self._conn.executemany('INSERT OR IGNORE INTO bands (band, value, doc_id) VALUES (?, ?, ?)',
+                                       [(band, value, doc_id) for band, value in bands(fingerprint, self.band_count)])
+            self._conn.commit()
+
+    def move_group(self, old_canonical_id, new_canonical_id):
+        with self.lock:
+            row = self._conn.execute('SELECT fingerprint FROM chunks WHERE doc_id = ?', (old_canonical_id,)).fetchone()
+            self._conn.execute('UPDATE chunks SET canonical_id = ? WHERE canonical_id = ?',
+                               (new_canonical_id, old_canonical_id))
+            self._conn.execute('DELETE FROM bands WHERE doc_id = ?', (new_canonical_id,))
+            self._conn.execute('UPDATE bands SET doc_id = ? WHERE doc_id = ?', (new_canonical_id, old_canonical_id))
+            if row:
+                self._conn.execute('UPDATE chunks SET fingerprint = ? WHERE doc_id = ?', (row[0], new_canonical_id))
+            self._conn.commit()
+
+    def remove(self, doc_ids):
+        doc_ids = list(doc_ids)
+        with self.lock:
+            for i in range(0, len(doc_ids), SQLITE_MAX_PARAMS):
+                batch = doc_ids[i:i + SQLITE_MAX_PARAMS]
+                placeholders = ','.join('?' * len(batch))
+                self._conn.execute(f'DELETE FROM chunks WHERE doc_id IN ({placeholders})', batch)
+                self._conn.execute(f'DELETE FROM bands WHERE doc_id IN ({placeholders})', batch)
+            self._conn.commit()
+
+
+def to_entry(row):
+    doc_id, page_id, fingerprint, canonical_id, metadata = row
+    return {
+        'doc_id': doc_id,
+        'page_id': page_id,
+        'fingerprint': fingerprint,
+        'canonical_id': canonical_id,
+        'metadata': json.loads(metadata) if metadata else {}
+    }
+
+
+def join_page_ids(page_ids):
+    return ','.join(sorted({str(page_id) for page_id in page_ids if page_id}))
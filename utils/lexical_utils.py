@@ -0,0 +1,250 @@
+from array import array
+from collections import Counter
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_ENABLED = os.getenv('LEXICAL_INDEX_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+LEXICAL_INDEX_DIRECTORY = os.getenv('LEXICAL_INDEX_DIRECTORY') or os.path.join(os.getenv('VECTOR_DB_DIRECTORY') or '.', 'lexical_index')
+LEXICAL_RESULTS_PER_QUERY = int(os.getenv('LEXICAL_RESULTS_PER_QUERY', 10))
+LEXICAL_SKIP_COVERAGE = float(os.getenv('LEXICAL_SKIP_COVERAGE', 0.7))
+LEXICAL_SKIP_MIN_TERMS = int(os.getenv('LEXICAL_SKIP_MIN_TERMS', 5))
+RRF_K = int(os.getenv('RRF_K', 60))
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_TERM_FREQUENCY = np.iinfo(np.uint16).max
+SQLITE_MAX_PARAMS = 500
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+(?:[-_./][a-z0-9]+)*')
+STOP_WORDS = frozenset('''a an and are as at be been but by can could do does for from has have if in into is it its
+may might must not of on or our shall should so such than that the their then there these this those to was we were
+what when where which while who will with would you your'''.split())
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(directory=LEXICAL_INDEX_DIRECTORY):
+    if not LEXICAL_INDEX_ENABLED:
+        return None
+    with _indexes_lock:
+        index = _indexes.get(directory)
+        if index is None:
+            try:
+                index = LexicalIndex(directory)
+            except (OSError, sqlite3.Error) as e:
+                logger.exception(f'Could not open lexical index at {directory}, lexical search disabled: {e}')
+                return None
+            _indexes[directory] = index
+        return index
+
+
+def tokenize(text):
+    terms = []
+    for token in TOKEN_PATTERN.findall((text or '').lower()):
+        if token in STOP_WORDS:
+            continue
+        terms.append(token)
+        parts = re.split(r'[-_./]', token)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part and part not in STOP_WORDS)
+    return terms
+
+
+class LexicalIndex:
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_path = os.path.join(directory, 'segment')
+        self.dirty = False
+        self._segment = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, 'staging.sqlite3'), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, length INTEGER NOT NULL)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS postings ('
+            'term TEXT NOT NULL, doc_id TEXT NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY (term, doc_id)) WITHOUT ROWID'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS postings_doc_id ON postings (doc_id)')
+        self._conn.commit()
+
+    def upsert(self, ids, documents):
+        docs = []
+        postings = []
+        for doc_id, document in zip(ids, documents):
+            terms = tokenize(document)
+            docs.append((doc_id, len(terms)))
+            postings.extend((term, doc_id, tf) for term, tf in Counter(terms).items())
+        with self._lock:
+            self._delete(ids)
+            self._conn.executemany('INSERT OR REPLACE INTO docs (id, length) VALUES (?, ?)', docs)
+            self._conn.executemany('INSERT OR REPLACE INTO postings (term, doc_id, tf) VALUES (?, ?, ?)', postings)
+            self._conn.commit()
+            self.dirty = True
+
+    def delete(self, ids):
+        with self._lock:
+            self._delete(ids)
+            self._conn.commit()
+            self.dirty = True
+
+    def _delete(self, ids):
+        ids = list(ids)
+        for i in range(0, len(ids), SQLITE_MAX_PARAMS):
+            batch = ids[i:i + SQLITE_MAX_PARAMS]
+            placeholders = ','.join('?' * len(batch))
+            self._conn.execute(f'DELETE FROM postings WHERE doc_id IN ({placeholders})', batch)
+            self._conn.execute(f'DELETE FROM docs WHERE id IN ({placeholders})', batch)
+
+    def compact(self):
+        with self._lock:
+            doc_ids = []
+            lengths = array('i')
+            for doc_id, length in self._conn.execute('SELECT id, length FROM docs ORDER BY id'):
+                doc_ids.append(doc_id)
+                lengths.append(length)
+            positions = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+
+            vocabulary = {}
+            postings_docs = array('i')
+            postings_tf = array('H')
+            term = None
+            rows = self._conn.execute('SELECT term, doc_id, tf FROM postings ORDER BY term, doc_id')
+            for row_term, doc_id, tf in rows:
+                if row_term != term:
+                    term = row_term
+                    vocabulary[term] = [len(postings_docs), 0]
+                vocabulary[term][1] += 1
+                postings_docs.append(positions[doc_id])
+                postings_tf.append(min(tf, MAX_TERM_FREQUENCY))
+
+            tmp_path = f'{self.segment_path}.tmp'
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+            np.save(os.path.join(tmp_path, 'doc_lengths.npy'), np.frombuffer(lengths, dtype=np.int32))
+            np.save(os.path.join(tmp_path, 'postings_docs.npy'), np.frombuffer(postings_docs, dtype=np.int32))
+            np.save(os.path.join(tmp_path, 'postings_tf.npy'), np.frombuffer(postings_tf, dtype=np.uint16))
+            with open(os.path.join(tmp_path, 'doc_ids.json'), 'w', encoding='utf-8') as f:
+                json.dump(doc_ids, f)
+            with open(os.path.join(tmp_path, 'vocabulary.json'), 'w', encoding='utf-8') as f:
+                json.dump(vocabulary, f)
+
+            old_path = f'{self.segment_path}.old'
+            shutil.rmtree(old_path, ignore_errors=True)
+            if os.path.isdir(self.segment_path):
+                os.replace(self.segment_path, old_path)
+            os.replace(tmp_path, self.segment_path)
+            shutil.rmtree(old_path, ignore_errors=True)
+            self._segment = None
+            self.dirty = False
+        logger.info(f'Compacted lexical index: {len(doc_ids)} chunks, {len(vocabulary)} terms, '
+                    f'{len(postings_docs)} postings')
+
+    def compact_if_dirty(self):
+        if self.dirty:
+            self.compact()
+
+    def segment(self):
+        with self._lock:
+            if self._segment is None and os.path.isfile(os.path.join(self.segment_path, 'vocabulary.json')):
+                self._segment = LexicalSegment(self.segment_path)
+            return self._segment
+
+    def search(self, text, top_n=LEXICAL_RESULTS_PER_QUERY):
+        segment = self.segment()
+        if segment is None:
+            return LexicalResult([], 0.0)
+        return segment.search(tokenize(text), top_n)
+
+
+class LexicalSegment:
+    def __init__(self, path):
+        with open(os.path.join(path, 'doc_ids.json'), 'r', encoding='utf-8') as f:
+            self.doc_ids = json.load(f)
+        with open(os.path.join(path, 'vocabulary.json'), 'r', encoding='utf-8') as f:
+            self.vocabulary = json.load(f)
+        self.doc_lengths = np.load(os.path.join(path, 'doc_lengths.npy'), mmap_mode='r')
+        self.postings_docs = np.load(os.path.join(path, 'postings_docs.npy'), mmap_mode='r')
+        self.postings_tf = np.load(os.path.join(path, 'postings_tf.npy'), mmap_mode='r')
+        self.doc_count = len(self.doc_ids)
+        self.average_length = float(self.doc_lengths.mean()) if self.doc_count else 0.0
+
+    def idf(self, document_frequency):
+        return math.log(1 + (self.doc_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def search(self, terms, top_n=LEXICAL_RESULTS_PER_QUERY):
+        query = Counter(terms)
+        if not query or not self.doc_count:
+            return LexicalResult([], 0.0, len(query))
+
+        matched = []
+        total_idf = 0.0
+        for term, query_tf in query.items():
+            start, count = self.vocabulary.get(term, (0, 0))
+            idf = self.idf(count)
+            total_idf += idf * query_tf
+            if count:
+                matched.append((idf * query_tf, self.postings_docs[start:start + count],
+                                self.postings_tf[start:start + count]))
+        if not matched:
+            return LexicalResult([], 0.0, len(query))
+
+        docs = np.concatenate([postings for _, postings, _ in matched])
+        tf = np.concatenate([frequencies for _, _, frequencies in matched]).astype(np.float32)
+        weights = np.concatenate([np.full(len(postings), weight, dtype=np.float32) for weight, postings, _ in matched])
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[docs] / self.average_length)
+        contributions = weights * tf * (BM25_K1 + 1) / (tf + norm)
+
+        unique_docs, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions)
+        order = np.argsort(-scores, kind='stable')[:top_n]
+
+        best = unique_docs[order[0]]
+        covered = sum(weight for weight, postings, _ in matched if contains(postings, best))
+        hits = [(self.doc_ids[unique_docs[i]], float(scores[i])) for i in order]
+        return LexicalResult(hits, covered / total_idf if total_idf else 0.0, len(query))
+
+
+class LexicalResult:
+    def __init__(self, hits, coverage, terms=0):
+        self.hits = hits
+        self.coverage = coverage
+        self.terms = terms
+
+    def is_strong(self, coverage=LEXICAL_SKIP_COVERAGE, min_terms=LEXICAL_SKIP_MIN_TERMS):
+        return coverage > 0 and bool(self.hits) and self.terms >= min_terms and self.coverage >= coverage
+
+
+def contains(sorted_values, value):
+    position = np.searchsorted(sorted_values, value)
+    return position < len(sorted_values) and sorted_values[position] == value
+
+
+def merge_lexical_hits(results, top_k):
+    scores = {}
+    for result in results:
+        if not result.hits:
+            continue
+        best = result.hits[0][1]
+        for doc_id, score in result.hits:
+            scores[doc_id] = scores.get(doc_id, 0.0) + score / best
+    return sorted(scores.items(), key=lambda item: -item[1])[:top_k]
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K, top_k=None):
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    ordered = sorted(fused.items(), key=lambda item: -item[1])
+    return ordered[:top_k] if top_k else ordered
@@ -1,28 +1,71 @@
 import logging
 from ollama import embed, chat
+import os
 import textwrap
+import threading
+import time
+from utils.cache_utils import get_embedding_cache
 
 logger = logging.getLogger(__name__)
 
 EMBEDDING_MODEL = 'nomic-embed-text'
 GENERATION_MODEL = 'mistral:7b'
+EMBEDDING_MAX_LENGTH = 7000
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', 32))
+EMBED_BATCH_MAX_CHARS = int(os.getenv('EMBED_BATCH_MAX_CHARS', 32000))
+GENERATION_NUM_CTX = int(os.getenv('GENERATION_NUM_CTX', 8192))
+GENERATION_RESERVED_TOKENS = int(os.getenv('GENERATION_RESERVED_TOKENS', 2048))
+OUTLINE_MAX_TOKENS = int(os.getenv('OUTLINE_MAX_TOKENS', 512))
+OLLAMA_NUM_PARALLEL = int(os.getenv('OLLAMA_NUM_PARALLEL', 1))
+
+
+def parse_keep_alive(value):
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+OLLAMA_KEEP_ALIVE = parse_keep_alive(os.getenv('OLLAMA_KEEP_ALIVE'))
+
+_chat_slots = threading.BoundedSemaphore(max(1, OLLAMA_NUM_PARALLEL))
+
+
+def set_keep_alive(keep_alive):
+    global OLLAMA_KEEP_ALIVE
+    OLLAMA_KEEP_ALIVE = keep_alive
+
+
+def set_chat_parallelism(parallel):
+    global _chat_slots
+    _chat_slots = threading.BoundedSemaphore(max(1, parallel))
+
+PRD_SECTIONS = [
+    ('Overview', 'Brief summary of the product or feature.'),
+    ('Scope', 'Objectives this product/feature aims to achieve.'),
+    ('User Stories / Use Cases', 'Realistic user scenarios demonstrating how the feature will be used.'),
+    ('Requirements', 'Specific, testable features and capabilities.'),
+    ('Acceptance Criteria', 'Clear pass/fail criteria for validating delivery.'),
+    ('Out of Scope', 'Features or elements not included in this release.')
+]
 
 def get_embedding(text, model=EMBEDDING_MODEL):
-    if not text or not text.strip():
-        logger.warning("Empty text provided for embedding")
+    if not is_embeddable(text):
         return None
-        
+
+    cache = get_embedding_cache()
+    if cache and (cached := cache.get(model, text)) is not None:
+        return cached
+
     try:
-        max_length = 7000
-        if len(text) > max_length:
-            logger.error(f'Text too long ({len(text)} chars) for embedding model context length. '
-                        f'Consider re-chunking this text. Preview: {text[:100]}...')
-            return None
-            
-        response = embed(model=model, input=text)
+        response = embed(model=model, input=text, keep_alive=OLLAMA_KEEP_ALIVE)
         embeddings = response.get('embeddings')
         
         if embeddings and len(embeddings) > 0:
+            if cache:
+                cache.put(model, text, embeddings[0])
             return embeddings[0]
         else:
             logger.error('No embeddings returned from Ollama')
@@ -34,6 +77,81 @@ def get_embedding(text, model=EMBEDDING_MODEL):
         return None
 
 
+def is_embeddable(text):
+    if not text or not text.strip():
+        logger.warning('Empty text provided for embedding')
+        return False
+    if len(text) > EMBEDDING_MAX_LENGTH:
+        logger.error(f'Text too long ({len(text)} chars) for embedding model context length. '
+                    f'Consider re-chunking this text. Preview: {text[:100]}...')
+        return False
+    return True
+
+
+def batch_texts(texts, batch_size=EMBED_BATCH_SIZE, max_chars=EMBED_BATCH_MAX_CHARS, key=None):
+    batch = []
+    batch_chars = 0
+    for item in texts:
+        size = len((key(item) if key else item) or '')
+        if batch and (len(batch) >= batch_size or batch_chars + size > max_chars):
+            yield batch
+            batch = []
+            batch_chars = 0
+        batch.append(item)
+        batch_chars += size
+    if batch:
+        yield batch
+
+
+def embed_batch(texts, model=EMBEDDING_MODEL):
+    embeddings = [None] * len(texts)
+    valid = [i for i, text in enumerate(texts) if is_embeddable(text)]
+    if not valid:
+        return embeddings
+
+    cache = get_embedding_cache()
+    if cache:
+        for i, cached in zip(valid, cache.get_many(model, [texts[i] for i in valid])):
+            embeddings[i] = cached
+        valid = [i for i in valid if embeddings[i] is None]
+        if not valid:
+            return embeddings
+
+    try:
+        response = embed(model=model, input=[texts[i] for i in valid], keep_alive=OLLAMA_KEEP_ALIVE)
+        results = response.get('embeddings') or []
+        if len(results) != len(valid):
+            raise ValueError(f'Expected {len(valid)} embeddings, got {len(results)}')
+        for i, embedding in zip(valid, results):
+            embeddings[i] = embedding
+        if cache:
+            cache.put_many(model, [texts[i] for i in valid], results)
+    except Exception as e:
+        logger.warning(f'Batch embedding of {len(valid)} texts failed, retrying one by one: {e}')
+        for i in valid:
+            embeddings[i] = get_embedding(texts[i], model=model)
+    return embeddings
+
+
+def embed_stream(texts, model=EMBEDDING_MODEL, batch_size=EMBED_BATCH_SIZE, max_chars=EMBED_BATCH_MAX_CHARS, key=None):
+    for batch in batch_texts(texts, batch_size=batch_size, max_chars=max_chars, key=key):
+        batch_texts_only = [key(item) for item in batch] if key else batch
+        yield from zip(batch, embed_batch(batch_texts_only, model=model))
+
+
+def get_embeddings(texts, model=EMBEDDING_MODEL, batch_size=EMBED_BATCH_SIZE, max_chars=EMBED_BATCH_MAX_CHARS):
+    return [embedding for _, embedding in embed_stream(texts, model=model, batch_size=batch_size, max_chars=max_chars)]
+
+
+def preload_models(keep_alive=None):
+    keep_alive = OLLAMA_KEEP_ALIVE if keep_alive is None else keep_alive
+    started = time.perf_counter()
+    embed(model=EMBEDDING_MODEL, input='warm up', keep_alive=keep_alive)
+    chat(model=GENERATION_MODEL, messages=[], options={'num_ctx': GENERATION_NUM_CTX}, keep_alive=keep_alive)
+    logger.info(f'Loaded {EMBEDDING_MODEL} and {GENERATION_MODEL} in {time.perf_counter() - started:.2f}s '
+                f'(keep_alive {keep_alive if keep_alive is not None else "server default"})')
+
+
 def get_promt(input_text, context):
     prompt = f'''You are a product manager tasked with creating a detailed Product Requirement Document (PRD).
         Use the following input information to generate a clear, well-organized PRD that adheres to best practices. Leverage user requirements, input data, and relevant examples from previous PRDs to inform your writing.
@@ -61,16 +179,128 @@ def get_promt(input_text, context):
     return textwrap.dedent(prompt)
 
 
-def generate_prd(input_text, context):
-    prompt = get_promt(input_text, context)
+def get_outline_prompt(input_text, context):
+    sections = '\n'.join(f'## {title}' for title, _ in PRD_SECTIONS)
+    prompt = f'''You are a product manager planning a Product Requirement Document (PRD).
+        Read the input and reference material and write a short outline that the individual PRD sections will be written from.
+        ---
+        ### New Product Input
+        {input_text}
+        ### Reference PRD Examples
+        {context}
+        ---
+        ### Instructions
+        Start with a `# ` title line naming the product or feature, then give each of these headings 2-5 terse bullet points with the key facts, names, numbers and decisions that section must cover:
+        {sections}
+        - Keep every bullet under 20 words and do not write the sections themselves.
+        - Use the same terminology in every section so they read as one document.
+        - If the input says nothing relevant for a section, write a single `- TBD` bullet.
+        '''
+    return textwrap.dedent(prompt)
+
+
+def get_section_prompt(input_text, outline, section_number, title, description, context):
+    prompt = f'''You are a product manager writing one section of a Product Requirement Document (PRD).
+        ---
+        ### New Product Input
+        {input_text}
+        ### PRD Outline
+        {outline}
+        ### Reference PRD Examples
+        {context}
+        ---
+        ### Instructions
+        Write only section {section_number}, **{title}** - {description}
+        - Start with the heading `## {section_number}. {title}` and do not write any other section.
+        - Cover the outline points for this section and stay consistent with the rest of the outline.
+        - Incorporate relevant details or phrasing from the Reference PRD Examples to improve consistency and quality.
+        - Avoid vague or generic language—be precise and practical.
+        - If the input lacks detail for this section, flag it clearly with a placeholder like `> TBD` or suggest reasonable defaults.
+        - Format the section as clean markdown.
+        '''
+    return textwrap.dedent(prompt)
+
+
+def log_prompt_stats(response, stats):
+    prompt_tokens = response.get('prompt_eval_count')
+    prompt_eval_duration = response.get('prompt_eval_duration')
+    if prompt_tokens is not None:
+        stats['prompt_tokens'] = prompt_tokens
+    if prompt_eval_duration:
+        stats['prefill_time'] = prompt_eval_duration / 1e9
+    if 'prompt_tokens' in stats:
+        logger.info(f'Prompt of {stats["prompt_tokens"]} tokens prefilled in {stats.get("prefill_time", 0):.2f}s')
+        if stats['prompt_tokens'] >= GENERATION_NUM_CTX:
+            logger.warning(f'Prompt filled the whole {GENERATION_NUM_CTX} token context window and may have been truncated')
+
+
+def generate_prd(input_text, context, stats=None):
+    return complete(get_promt(input_text, context), stats=stats)
+
+
+def complete(prompt, stats=None, max_tokens=None):
     logger.debug(f'generated prompt : {prompt}')
-    response = chat(
-        model='mistral:7b',
-        messages=[
-            {
-                'role': 'user',
-                'content': prompt
-            }
-        ]
-    )
+    stats = {} if stats is None else stats
+    options = {'num_ctx': GENERATION_NUM_CTX}
+    if max_tokens:
+        options['num_predict'] = max_tokens
+    with _chat_slots:
+        response = chat(
+            model=GENERATION_MODEL,
+            messages=[
+                {
+                    'role': 'user',
+                    'content': prompt
+                }
+            ],
+            options=options,
+            keep_alive=OLLAMA_KEEP_ALIVE
+        )
+    log_prompt_stats(response, stats)
     return response['message']['content']
+
+
+def stream_prd(input_text, context, stats=None):
+    prompt = get_promt(input_text, context)
+    logger.debug(f'generated prompt : {prompt}')
+    stats = {} if stats is None else stats
+    started = time.perf_counter()
+    first_token_at = None
+    tokens = 0
+    final = {}
+
+    with _chat_slots:
+        for part in chat(
+            model=GENERATION_MODEL,
+            messages=[
+                {
+                    'role': 'user',
+                    'content': prompt
+                }
+            ],
+            options={'num_ctx': GENERATION_NUM_CTX},
+            keep_alive=OLLAMA_KEEP_ALIVE,
+            stream=True
+        ):
+            content = part['message']['content']
+            if content:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    stats['time_to_first_token'] = first_token_at - started
+                    logger.info(f'First token after {stats["time_to_first_token"]:.2f}s')
+                tokens += 1
+                yield content
+            if part.get('done'):
+                final = part
+
+    finished = time.perf_counter()
+    log_prompt_stats(final, stats)
+    stats['total_time'] = finished - started
+    stats['tokens'] = final.get('eval_count') or tokens
+    eval_duration = final.get('eval_duration')
+    if eval_duration:
+        stats['tokens_per_sec'] = stats['tokens'] / (eval_duration / 1e9)
+    elif first_token_at is not None and finished > first_token_at:
+        stats['tokens_per_sec'] = stats['tokens'] / (finished - first_token_at)
+    logger.info(f'Generated {stats["tokens"]} tokens in {stats["total_time"]:.2f}s '
+                f'({stats.get("tokens_per_sec", 0):.2f} tokens/sec)')
@@ -0,0 +1,166 @@
+import logging
+import math
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 64))
+PIPELINE_REPORT_INTERVAL = float(os.getenv('PIPELINE_REPORT_INTERVAL', 30))
+BATCH_WAIT_SECONDS = 0.05
+
+_DONE = object()
+
+
+class Stage:
+    def __init__(self, name, fn, workers=1, batch_size=None):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.items_in = 0
+        self.items_out = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def record(self, items_in, items_out, busy_time, failed=False):
+        with self._lock:
+            self.items_in += items_in
+            self.items_out += items_out
+            self.busy_time += busy_time
+            self.latencies.append(busy_time)
+            if failed:
+                self.errors += 1
+
+    def metrics(self, elapsed):
+        with self._lock:
+            latencies = sorted(self.latencies)
+        return {
+            'items_in': self.items_in,
+            'items_out': self.items_out,
+            'items_per_sec': self.items_in / elapsed if elapsed > 0 else 0.0,
+            'utilisation': self.busy_time / (elapsed * self.workers) if elapsed > 0 else 0.0,
+            'workers': self.workers,
+            'errors': self.errors,
+            'p50_seconds': percentile(latencies, 50),
+            'p99_seconds': percentile(latencies, 99)
+        }
+
+    def summary(self, elapsed):
+        metrics = self.metrics(elapsed)
+        return (f'{self.name}: {metrics["items_in"]} in, {metrics["items_out"]} out, '
+                f'{metrics["items_per_sec"]:.1f} items/sec, {metrics["utilisation"]:.0%} busy across '
+                f'{self.workers} workers, p50 {metrics["p50_seconds"] * 1000:.1f}ms, '
+                f'p99 {metrics["p99_seconds"] * 1000:.1f}ms, {self.errors} errors')
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(q / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class Pipeline:
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE, report_interval=PIPELINE_REPORT_INTERVAL):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.report_interval = report_interval
+        self.started = None
+
+    def run(self, source):
+        self.started = time.perf_counter()
+        finished = threading.Event()
+        threads = [threading.Thread(target=self._feed, args=(source,), name='pipeline-source', daemon=True)]
+        for index, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            remaining_lock = threading.Lock()
+            for n in range(stage.workers):
+                threads.append(threading.Thread(target=self._work, args=(index, remaining, remaining_lock),
+                                                name=f'pipeline-{stage.name}-{n}', daemon=True))
+        reporter = threading.Thread(target=self._report, args=(finished,), name='pipeline-report', daemon=True)
+
+        for t in threads:
+            t.start()
+        reporter.start()
+        for t in threads:
+            t.join()
+        finished.set()
+        reporter.join()
+        self.log_metrics()
+        return self.stages
+
+    def elapsed(self):
+        return time.perf_counter() - self.started if self.started else 0.0
+
+    def log_metrics(self):
+        elapsed = self.elapsed()
+        for stage in self.stages:
+            logger.info(f'[pipeline {elapsed:.1f}s] {stage.summary(elapsed)}')
+
+    def _feed(self, source):
+        try:
+            for item in source:
+                self.queues[0].put(item)
+        except Exception as e:
+            logger.exception(f'Pipeline source failed: {e}')
+        finally:
+            for _ in range(self.stages[0].workers):
+                self.queues[0].put(_DONE)
+
+    def _work(self, index, remaining, remaining_lock):
+        stage = self.stages[index]
+        inbox = self.queues[index]
+        outbox = self.queues[index + 1] if index + 1 < len(self.stages) else None
+        done = False
+
+        while not done:
+            item = inbox.get()
+            if item is _DONE:
+                break
+            items = [item]
+            if stage.batch_size:
+                deadline = time.perf_counter() + BATCH_WAIT_SECONDS
+                while len(items) < stage.batch_size:
+                    try:
+                        item = inbox.get(timeout=max(0.0, deadline - time.perf_counter()))
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        done = True
+                        break
+                    items.append(item)
+            self._process(stage, items if stage.batch_size else items[0], len(items), outbox)
+
+        with remaining_lock:
+            remaining[0] -= 1
+            last_worker = remaining[0] == 0
+        if last_worker and outbox is not None:
+            for _ in range(self.stages[index + 1].workers):
+                outbox.put(_DONE)
+
+    def _process(self, stage, payload, count, outbox):
+        started = time.perf_counter()
+        produced = 0
+        failed = False
+        try:
+            for result in stage.fn(payload) or ():
+                produced += 1
+                if outbox is not None:
+                    outbox.put(result)
+        except Exception as e:
+            failed = True
+            logger.exception(f'Pipeline stage {stage.name} failed: {e}')
+        stage.record(count, produced, time.perf_counter() - started, failed=failed)
+
+    def _report(self, finished):
+        while not finished.wait(self.report_interval):
+            elapsed = self.elapsed()
+            depths = ', '.join(f'{stage.name}={q.qsize()}' for stage, q in zip(self.stages, self.queues))
+            logger.info(f'[pipeline {elapsed:.1f}s] queue depths: {depths}')
+            for stage in self.stages:
+                logger.info(f'[pipeline {elapsed:.1f}s] {stage.summary(elapsed)}')
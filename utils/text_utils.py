@@ -1,155 +1,314 @@
 import logging
+import os
 import pymupdf
 import re
-from utils.db_utils import load_data_to_db
-from utils.ollama_utils import get_embedding
+from utils.db_utils import BulkWriter
+from utils.ollama_utils import embed_stream
 
 logger = logging.getLogger(__name__)
 
-def process_pdf(pdfs, page):
-    from ingestion.utils.confluence_utils import download_attachment
+CHUNK_MAX_LENGTH = int(os.getenv('CHUNK_MAX_LENGTH', 550))
+CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', 50))
+CHUNK_LENGTH_UNIT = os.getenv('CHUNK_LENGTH_UNIT', 'chars')
+CHARS_PER_TOKEN = 4
+HEADING_MIN_FILL = 0.25
+
+PARAGRAPH_BREAK = re.compile(r'\n[ \t\r\f\v]*\n\s*')
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+')
+WHITESPACE = re.compile(r'\s+')
+WORD = re.compile(r'\S+')
+TOKEN = re.compile(r'\w{1,6}|[^\w\s]')
+HEADING_PATTERN = re.compile(r'#{1,6}[ \t]+[^\n]{1,120}|(?:\d+(?:\.\d+)*\.?[ \t]+)?[A-Z][^\n.!?:;,]{0,79}')
+
+def process_pdf(pdfs, page, writer=None):
     if not pdfs:
         logger.debug('No pdfs in this doc')
+        return []
+    return process_documents(iter_pdf_documents(pdfs, page), writer=writer)
+
+
+def iter_pdf_documents(pdfs, page, on_skip=None):
+    from ingestion.utils.confluence_utils import download_attachments
+    if not pdfs:
         return
     title = page.get('title', '')
     page_id = page.get('page_id', '')
-    if title:
-        safe_title = ''.join(c for c in title if c.isalnum() or c in (' ', '-', '_')).rstrip()
+    safe_title = ''.join(c for c in title if c.isalnum() or c in (' ', '-', '_')).rstrip()
+
+    for pdf, path in download_attachments(page_id, safe_title or 'Untitled', pdfs):
+        if not path:
+            logger.warning(f'Could not download pdf {pdf} for page {title}')
+            if on_skip:
+                on_skip(pdf)
+            continue
+        yield iter_pdf_pages(path), page, pdf
+
 
-    for pdf in pdfs:
-        path = download_attachment(page_id, safe_title or 'Untitled', pdf)
-        doc = pymupdf.open(path)
-        all_text = []
+def iter_pdf_pages(path):
+    with pymupdf.open(path) as doc:
         for p in doc:
-            text = p.get_text()
-            all_text.append(text)
-        full_text = '\n'.join(all_text)
-        process_text(full_text, page, pdf=pdf)
+            yield p.get_text()
 
 
-def process_text(text, page, pdf=''):
+def process_text(text, page, pdf='', writer=None):
     if not text:
         logger.debug('No Text to process')
-        return
-    page_id = page.get('page_id', '')
-    title = page.get('title')
-    chunks = chunk_text(text, max_length=550, overlap=50)
-    for chunk_idx, chunk in enumerate(chunks):
+        return []
+    return process_documents([(text, page, pdf)], writer=writer)
+
+
+def process_documents(documents, writer=None):
+    if writer is None:
+        with BulkWriter() as writer:
+            return process_documents(documents, writer=writer)
+
+    doc_ids = []
+    chunks = skip_duplicate_chunks(iter_document_chunks(documents), writer, on_duplicate=doc_ids.append)
+    for (page, pdf, chunk_idx, chunk), embedding in embed_chunks(chunks):
+        page_id = page.get('page_id', '')
+        title = page.get('title')
         try:
-            embedding = get_embedding(chunk)
             if embedding is None:
                 logger.warning(f'Failed to generate embedding for chunk {chunk_idx} of page: {title}')
                 continue
-            if pdf:
-                doc_id = f'{page_id}--pdf-{pdf}--chunk-{chunk_idx}'
-            else:
-                doc_id = f'{page_id}--chunk-{chunk_idx}'
-            load_data_to_db(page, chunk_idx, chunk, doc_id, embedding, pdf)
+            doc_id = make_doc_id(page_id, chunk_idx, pdf)
+            writer.add(page, chunk_idx, chunk, doc_id, embedding, pdf)
+            doc_ids.append(doc_id)
         except Exception as e:
             logger.error(f'Error processing chunk {chunk_idx} for pdf {pdf} in page {title}, id {page_id}: {e}')
-            
-    logger.info(f'Successfully embedded doc: pdf {pdf} or page {title} in ({len(chunks)} chunks)')
+    return doc_ids
+
+
+def iter_document_chunks(documents):
+    for text, page, pdf in documents:
+        if not text:
+            logger.debug('No Text to process')
+            continue
+        if isinstance(text, str):
+            chunks = chunk_text(text, max_length=CHUNK_MAX_LENGTH, overlap=CHUNK_OVERLAP, length=CHUNK_LENGTH_UNIT)
+        else:
+            chunks = chunk_segments(text, max_length=CHUNK_MAX_LENGTH, overlap=CHUNK_OVERLAP,
+                                    length=CHUNK_LENGTH_UNIT)
+        chunk_count = 0
+        for chunk_idx, chunk in enumerate(chunks):
+            chunk_count += 1
+            yield page, pdf, chunk_idx, chunk
+        logger.info(f'Queued doc for embedding: pdf {pdf} or page {page.get("title")} in ({chunk_count} chunks)')
+
+
+def skip_duplicate_chunks(chunk_items, writer, on_duplicate=None):
+    for item in chunk_items:
+        doc_id = add_duplicate_chunk(item, writer)
+        if doc_id is None:
+            yield item
+        elif on_duplicate:
+            on_duplicate(doc_id)
+
+
+def add_duplicate_chunk(item, writer):
+    page, pdf, chunk_idx, chunk = item
+    doc_id = make_doc_id(page.get('page_id', ''), chunk_idx, pdf)
+    if writer.add_duplicate(page, chunk_idx, chunk, doc_id, pdf):
+        return doc_id
+    return None
+
+
+def embed_chunks(chunk_items):
+    return embed_stream(chunk_items, key=lambda item: item[3])
 
 
-def chunk_text(text, max_length=500, overlap=50):
+def make_doc_id(page_id, chunk_idx, pdf=''):
+    if pdf:
+        return f'{page_id}--pdf-{pdf}--chunk-{chunk_idx}'
+    return f'{page_id}--chunk-{chunk_idx}'
+
+
+def chunk_text(text, max_length=500, overlap=50, length='chars'):
     if not text or not text.strip():
         return []
-    
-    paragraphs = re.split(r'\n{2,}', text.strip())
-    chunks = []
-    current_chunk = ''
-    
-    for para in paragraphs:
-        para = para.strip()
-        if not para:
+    return [chunk for _, _, chunk in iter_chunk_spans(text, max_length=max_length, overlap=overlap, length=length)]
+
+
+def chunk_segments(segments, max_length=500, overlap=50, length='chars', separator='\n', buffer_factor=4):
+    for _, _, chunk in iter_segment_spans(segments, max_length=max_length, overlap=overlap, length=length,
+                                          separator=separator, buffer_factor=buffer_factor):
+        yield chunk
+
+
+def iter_segment_spans(segments, max_length=500, overlap=50, length='chars', separator='\n', buffer_factor=4):
+    max_chars = max_length * CHARS_PER_TOKEN if length == 'tokens' else max_length
+    buffer = ''
+    base = 0
+    resume = 0
+    lead = None
+    started = False
+
+    for segment in segments:
+        if not segment:
+            continue
+        buffer = f'{buffer}{separator}{segment}' if started else segment
+        started = True
+        if len(buffer) - resume < max_chars * buffer_factor:
             continue
-            
-        if len(para) > max_length:
-            sentences = split_into_sentences(para)
-            for sentence in sentences:
-                if len(current_chunk) + len(sentence) + 2 <= max_length:
-                    current_chunk += sentence + ' '
+        cut = buffer.rfind('\n\n', resume, len(buffer) - max_chars)
+        if cut <= resume:
+            cut = buffer.rfind(' ', resume, len(buffer) - max_chars)
+        if cut <= resume:
+            continue
+
+        last = None
+        for chunk_start, chunk_end, chunk in iter_chunk_spans(buffer, max_length, overlap, length,
+                                                               start=resume, end=cut, lead=lead):
+            last = (chunk_start, chunk_end)
+            yield base + chunk_start, base + chunk_end, chunk
+        keep = cut
+        lead = None
+        carry = overlap_start(buffer, *last, overlap, length) if last else None
+        if carry:
+            keep, lead = carry[0], 0
+        buffer = buffer[keep:]
+        base += keep
+        resume = cut - keep
+
+    if buffer[resume:].strip():
+        for chunk_start, chunk_end, chunk in iter_chunk_spans(buffer, max_length, overlap, length,
+                                                               start=resume, lead=lead):
+            yield base + chunk_start, base + chunk_end, chunk
+
+
+def iter_chunk_spans(text, max_length=500, overlap=50, length='chars', start=0, end=None, lead=None):
+    end = len(text) if end is None else end
+    measure = span_length(text, length)
+    chunk_start = chunk_end = None
+    chunk_size = 0
+    carry = (lead, measure(lead, start)) if lead is not None and lead < start else None
+    heading_tail = None
+
+    for unit_start, unit_end, unit_size, heading in iter_units(text, start, end, max_length, length):
+        if chunk_start is not None:
+            if length == 'tokens':
+                new_size = chunk_size + unit_size
+            else:
+                new_size = unit_end - chunk_start
+            breaks_section = heading and chunk_size >= max_length * HEADING_MIN_FILL
+            if new_size <= max_length and not breaks_section:
+                heading_tail = (unit_start, chunk_end, chunk_size) if heading else None
+                chunk_end, chunk_size = unit_end, new_size
+                continue
+
+            if heading_tail and heading_tail[0] > chunk_start:
+                heading_start, body_end, body_size = heading_tail
+                if length == 'tokens':
+                    section_size = chunk_size - body_size + unit_size
                 else:
-                    if current_chunk.strip():
-                        chunks.append(current_chunk.strip())
-                    current_chunk = sentence + ' '
+                    section_size = unit_end - heading_start
+                if section_size <= max_length:
+                    yield chunk_start, body_end, text[chunk_start:body_end]
+                    heading_tail = (unit_start, chunk_end, section_size - unit_size) if heading else None
+                    chunk_start, chunk_end, chunk_size = heading_start, unit_end, section_size
+                    continue
+
+            yield chunk_start, chunk_end, text[chunk_start:chunk_end]
+            carry = None if heading else overlap_start(text, chunk_start, chunk_end, overlap, length)
+
+        chunk_start, chunk_end, chunk_size = unit_start, unit_end, unit_size
+        heading_tail = None
+        if carry and not heading:
+            carry_start, carry_size = carry
+            carried_size = carry_size + unit_size if length == 'tokens' else unit_end - carry_start
+            if carried_size <= max_length:
+                chunk_start, chunk_size = carry_start, carried_size
+        carry = None
+
+    if chunk_start is not None:
+        yield chunk_start, chunk_end, text[chunk_start:chunk_end]
+
+
+def iter_units(text, start, end, max_length, length='chars'):
+    measure = span_length(text, length)
+    for para_start, para_end in iter_stripped_spans(text, PARAGRAPH_BREAK, start, end):
+        para_size = measure(para_start, para_end)
+        if para_size <= max_length:
+            heading = HEADING_PATTERN.fullmatch(text, para_start, para_end) is not None
+            yield para_start, para_end, para_size, heading
             continue
-        
-        if len(current_chunk) + len(para) + 2 <= max_length:
-            current_chunk += para + '\n\n'
-        else:
-            if current_chunk.strip():
-                chunks.append(current_chunk.strip())
-            current_chunk = para + '\n\n'
-    
-    if current_chunk.strip():
-        chunks.append(current_chunk.strip())
-    
-    if overlap > 0 and len(chunks) > 1:
-        chunks = add_overlap_to_chunks(chunks, overlap)
-    
-    validated_chunks = []
-    embedding_max_length = 7000
-    
-    for chunk in chunks:
-        if len(chunk) <= embedding_max_length:
-            validated_chunks.append(chunk)
-        else:
-            logger.warning(f'Chunk still too long ({len(chunk)} chars), force splitting...')
-            force_split_chunks = force_split_text(chunk, embedding_max_length - 100)
-            validated_chunks.extend(force_split_chunks)
-    return validated_chunks
-
-
-def split_into_sentences(text: str):
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    return [s.strip() for s in sentences if s.strip()]
-
-
-def add_overlap_to_chunks(chunks, overlap):
-    if len(chunks) <= 1:
-        return chunks
-    
-    overlapped_chunks = [chunks[0]]
-    
-    for i in range(1, len(chunks)):
-        prev_chunk = chunks[i-1]
-        current_chunk = chunks[i]
-        
-        if len(prev_chunk) > overlap:
-            overlap_text = prev_chunk[-overlap:].strip()
-            space_index = overlap_text.find(' ')
-            if space_index > 0:
-                overlap_text = overlap_text[space_index:].strip()
-            
-            overlapped_chunk = overlap_text + '\n\n' + current_chunk
-            overlapped_chunks.append(overlapped_chunk)
-        else:
-            overlapped_chunks.append(current_chunk)
-    return overlapped_chunks
-
-
-def force_split_text(text, max_length):
-    chunks = []
-    remaining_text = text
-    
-    while len(remaining_text) > max_length:
-        split_point = max_length
-        space_index = remaining_text.rfind(' ', 0, max_length)
-        if space_index > max_length * 0.8:
-            split_point = space_index
-        
-        chunk = remaining_text[:split_point].strip()
-        if chunk:
-            chunks.append(chunk)
-        
-        remaining_text = remaining_text[split_point:].strip()
-    
-    if remaining_text:
-        chunks.append(remaining_text)
-    return chunks
+        for sentence_start, sentence_end in iter_stripped_spans(text, SENTENCE_BREAK, para_start, para_end):
+            sentence_size = measure(sentence_start, sentence_end)
+            if sentence_size <= max_length:
+                yield sentence_start, sentence_end, sentence_size, False
+                continue
+            yield from iter_word_units(text, sentence_start, sentence_end, max_length, length)
+
+
+def iter_word_units(text, start, end, max_length, length='chars'):
+    measure = span_length(text, length)
+    max_chars = max_length * CHARS_PER_TOKEN if length == 'tokens' else max_length
+    for word in WORD.finditer(text, start, end):
+        word_start, word_end = word.span()
+        if word_end - word_start <= max_chars:
+            yield word_start, word_end, measure(word_start, word_end), False
+            continue
+        for piece_start in range(word_start, word_end, max_chars):
+            piece_end = min(piece_start + max_chars, word_end)
+            yield piece_start, piece_end, measure(piece_start, piece_end), False
+
+
+def iter_stripped_spans(text, separator, start, end):
+    position = start
+    for match in separator.finditer(text, start, end):
+        span = strip_span(text, position, match.start())
+        if span:
+            yield span
+        position = match.end()
+    span = strip_span(text, position, end)
+    if span:
+        yield span
+
+
+def strip_span(text, start, end):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return (start, end) if start < end else None
+
+
+def overlap_start(text, start, end, overlap, length='chars'):
+    if overlap <= 0:
+        return None
+    if length == 'tokens':
+        window = max(start, end - overlap * CHARS_PER_TOKEN * 2)
+        tokens = [token.start() for token in TOKEN.finditer(text, window, end)]
+        if window > start and tokens and tokens[0] == window and not text[window - 1].isspace():
+            tokens = tokens[1:]
+        if len(tokens) > overlap:
+            tokens = tokens[-overlap:]
+        if not tokens or tokens[0] <= start:
+            return None
+        return tokens[0], len(tokens)
+    if end - start <= overlap:
+        return None
+    gap = WHITESPACE.search(text, end - overlap, end)
+    if not gap or gap.end() >= end:
+        return None
+    return gap.end(), end - gap.end()
+
+
+def span_length(text, length='chars'):
+    if length == 'tokens':
+        return lambda start, end: count_tokens(text, start, end)
+    return lambda start, end: end - start
+
+
+def count_tokens(text, start=0, end=None):
+    end = len(text) if end is None else end
+    return sum(1 for _ in TOKEN.finditer(text, start, end))
+
+
+def estimate_tokens(text):
+    return len(text) // 4 if text else 0
 
 
 def validate_chunk_size(chunk, max_tokens=2000) -> bool:
-    estimated_tokens = len(chunk) // 4
+    estimated_tokens = estimate_tokens(chunk)
     return estimated_tokens <= max_tokens
@@ -0,0 +1,294 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'chroma').lower()
+VECTOR_INDEX_DIRECTORY = os.getenv('VECTOR_INDEX_DIRECTORY')
+VECTOR_INDEX_DTYPE = os.getenv('VECTOR_INDEX_DTYPE', 'int8').lower()
+VECTOR_RESCORE = os.getenv('VECTOR_RESCORE', 'true').lower() not in ('0', 'false', 'no')
+VECTOR_RESCORE_FACTOR = int(os.getenv('VECTOR_RESCORE_FACTOR', 4))
+VECTOR_QUERY_BLOCK_ROWS = int(os.getenv('VECTOR_QUERY_BLOCK_ROWS', 16384))
+INITIAL_CAPACITY = 1024
+SQLITE_MAX_PARAMS = 500
+DTYPES = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+DEFAULT_INCLUDE = ('documents', 'metadatas')
+
+
+def numpy_index_directory(db_path):
+    return VECTOR_INDEX_DIRECTORY or os.path.join(db_path or '.', 'numpy_index')
+
+
+def open_matrix(path, dtype, shape):
+    size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    with open(path, 'ab') as f:
+        if f.tell() < size:
+            f.truncate(size)
+    return np.memmap(path, dtype=dtype, mode='r+', shape=shape)
+
+
+class NumpyCollection:
+    def __init__(self, directory, dtype=VECTOR_INDEX_DTYPE):
+        if dtype not in DTYPES:
+            raise ValueError(f'Unsupported VECTOR_INDEX_DTYPE {dtype}, expected one of {", ".join(DTYPES)}')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dtype = dtype
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(directory, 'index.sqlite3'), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS items ('
+            'id TEXT PRIMARY KEY, row INTEGER UNIQUE NOT NULL, document TEXT, metadata TEXT)'
+        )
+        self._conn.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)')
+        self._conn.commit()
+
+        settings = dict(self._conn.execute('SELECT key, value FROM settings'))
+        self.dim = int(settings['dim']) if 'dim' in settings else None
+        self.capacity = int(settings.get('capacity', 0))
+        self.rows = int(settings.get('rows', 0))
+        self.row_of = dict(self._conn.execute('SELECT id, row FROM items'))
+        self.row_ids = [None] * self.capacity
+        self.valid = np.zeros(self.capacity, dtype=bool)
+        for doc_id, row in self.row_of.items():
+            self.row_ids[row] = doc_id
+            self.valid[row] = True
+        self.free = [row for row in range(self.rows - 1, -1, -1) if not self.valid[row]]
+        self.vectors = self.exact = self.scales = self.norms = None
+        if self.dim:
+            self._open_arrays(self.capacity)
+            if settings.get('dtype', self.dtype) != self.dtype:
+                self._requantize()
+        logger.debug(f'Opened numpy vector index at {directory} with {len(self.row_of)} vectors')
+
+    def _open_arrays(self, capacity):
+        self.vectors = open_matrix(self._path(f'vectors.{self.dtype}'), DTYPES[self.dtype], (capacity, self.dim))
+        self.exact = open_matrix(self._path('exact.float32'), np.float32, (capacity, self.dim))
+        self.scales = open_matrix(self._path(f'scales.{self.dtype}.float32'), np.float32, (capacity,))
+        self.norms = open_matrix(self._path(f'norms.{self.dtype}.float32'), np.float32, (capacity,))
+        self.capacity = capacity
+        if len(self.row_ids) < capacity:
+            self.row_ids.extend([None] * (capacity - len(self.row_ids)))
+            self.valid = np.concatenate([self.valid, np.zeros(capacity - len(self.valid), dtype=bool)])
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _requantize(self):
+        logger.info(f'Re-quantizing {self.rows} vectors in {self.directory} as {self.dtype}')
+        for start in range(0, self.rows, VECTOR_QUERY_BLOCK_ROWS):
+            end = min(start + VECTOR_QUERY_BLOCK_ROWS, self.rows)
+            self._store_vectors(np.arange(start, end), np.asarray(self.exact[start:end]))
+        self._flush_arrays()
+        self._save_settings()
+        self._conn.commit()
+
+    def _reserve(self, dim, count):
+        if self.dim is None:
+            self.dim = dim
+            self._open_arrays(max(INITIAL_CAPACITY, count))
+        elif dim != self.dim:
+            raise ValueError(f'Embedding dimension {dim} does not match index dimension {self.dim}')
+        needed = self.rows + max(0, count - len(self.free))
+        if needed > self.capacity:
+            self._flush_arrays()
+            self._open_arrays(max(needed, self.capacity * 2))
+
+    def _quantize(self, embeddings):
+        if self.dtype == 'int8':
+            scales = np.abs(embeddings).max(axis=1) / 127
+            scales[scales == 0] = 1.0
+            quantized = np.rint(embeddings / scales[:, None]).astype(np.int8)
+        else:
+            scales = np.ones(len(embeddings), dtype=np.float32)
+            quantized = embeddings.astype(DTYPES[self.dtype])
+        approx = quantized.astype(np.float32) * scales[:, None]
+        return quantized, scales, np.einsum('ij,ij->i', approx, approx)
+
+    def _store_vectors(self, rows, embeddings):
+        quantized, scales, norms = self._quantize(embeddings)
+        self.exact[rows] = embeddings
+        self.vectors[rows] = quantized
+        self.scales[rows] = scales
+        self.norms[rows] = norms
+
+    def _flush_arrays(self):
+        for array in (self.vectors, self.exact, self.scales, self.norms):
+            if array is not None:
+                array.flush()
+
+    def _save_settings(self):
+        settings = {'dim': self.dim, 'dtype': self.dtype, 'capacity': self.capacity, 'rows': self.rows}
+        self._conn.executemany('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+                               [(key, str(value)) for key, value in settings.items() if value is not None])
+
+    def _fetch(self, ids):
+        items = {}
+        ids = list(ids)
+        for i in range(0, len(ids), SQLITE_MAX_PARAMS):
+            batch = ids[i:i + SQLITE_MAX_PARAMS]
+            placeholders = ','.join('?' * len(batch))
+            rows = self._conn.execute(f'SELECT id, row, document, metadata FROM items WHERE id IN ({placeholders})',
+                                      batch)
+            for doc_id, row, document, metadata in rows:
+                items[doc_id] = (row, document, json.loads(metadata) if metadata else None)
+        return items
+
+    def _write(self, ids, embeddings=None, metadatas=None, documents=None, insert=True, replace=True):
+        with self._lock:
+            existing = self._fetch(ids)
+            last = {doc_id: i for i, doc_id in enumerate(ids)}
+            if not insert:
+                keep = [i for i, doc_id in enumerate(ids) if doc_id in existing]
+            elif not replace:
+                keep = [i for i, doc_id in enumerate(ids) if doc_id not in existing]
+            else:
+                keep = list(range(len(ids)))
+            keep = [i for i in keep if last[ids[i]] == i]
+            if len(keep) < len(ids):
+                skipped = len(ids) - len(keep)
+                logger.debug(f'Skipped {skipped} ids that {"do not exist" if not insert else "already exist"}')
+            if not keep:
+                return
+
+            if embeddings is not None:
+                vectors = np.asarray(embeddings, dtype=np.float32)[keep]
+                self._reserve(vectors.shape[1], len(keep))
+            elif any(ids[i] not in existing for i in keep):
+                raise ValueError('Embeddings are required to add new ids to the numpy vector index')
+
+            items = []
+            rows = []
+            for i in keep:
+                doc_id = ids[i]
+                row, document, metadata = existing.get(doc_id, (None, None, None))
+                if row is None:
+                    row = self.free.pop() if self.free else self.rows
+                    self.rows = max(self.rows, row + 1)
+                if documents is not None:
+                    document = documents[i]
+                if metadatas is not None and metadatas[i] is not None:
+                    metadata = {**(metadata or {}), **metadatas[i]}
+                rows.append(row)
+                items.append((doc_id, row, document, json.dumps(metadata) if metadata else None))
+
+            if embeddings is not None:
+                self._store_vectors(np.asarray(rows), vectors)
+                self._flush_arrays()
+            self._conn.executemany('INSERT OR REPLACE INTO items (id, row, document, metadata) VALUES (?, ?, ?, ?)',
+                                   items)
+            self._save_settings()
+            self._conn.commit()
+            for doc_id, row, _, _ in items:
+                self.row_of[doc_id] = row
+                self.row_ids[row] = doc_id
+                self.valid[row] = True
+
+    def add(self, ids, embeddings=None, metadatas=None, documents=None):
+        self._write(list(ids), embeddings, metadatas, documents, replace=False)
+
+    def upsert(self, ids, embeddings=None, metadatas=None, documents=None):
+        self._write(list(ids), embeddings, metadatas, documents)
+
+    def update(self, ids, embeddings=None, metadatas=None, documents=None):
+        self._write(list(ids), embeddings, metadatas, documents, insert=False)
+
+    def delete(self, ids=None):
+        with self._lock:
+            ids = [doc_id for doc_id in dict.fromkeys(ids or []) if doc_id in self.row_of]
+            if not ids:
+                return
+            for i in range(0, len(ids), SQLITE_MAX_PARAMS):
+                batch = ids[i:i + SQLITE_MAX_PARAMS]
+                self._conn.execute(f'DELETE FROM items WHERE id IN ({",".join("?" * len(batch))})', batch)
+            self._conn.commit()
+            for doc_id in ids:
+                row = self.row_of.pop(doc_id, None)
+                if row is None:
+                    continue
+                self.row_ids[row] = None
+                self.valid[row] = False
+                self.free.append(row)
+
+    def count(self):
+        return len(self.row_of)
+
+    def get(self, ids=None, include=DEFAULT_INCLUDE, limit=None, offset=None):
+        with self._lock:
+            if ids is not None:
+                items = self._fetch(ids)
+                ordered = [(doc_id, *items[doc_id]) for doc_id in dict.fromkeys(ids) if doc_id in items]
+                ordered = ordered[offset or 0:(offset or 0) + limit if limit else None]
+            else:
+                rows = self._conn.execute('SELECT id, row, document, metadata FROM items ORDER BY row LIMIT ? OFFSET ?',
+                                          (-1 if limit is None else limit, offset or 0))
+                ordered = [(doc_id, row, document, json.loads(metadata) if metadata else None)
+                           for doc_id, row, document, metadata in rows]
+            result = {'ids': [item[0] for item in ordered], 'documents': None, 'metadatas': None,
+                      'embeddings': None, 'included': list(include)}
+            if 'documents' in include:
+                result['documents'] = [item[2] for item in ordered]
+            if 'metadatas' in include:
+                result['metadatas'] = [item[3] for item in ordered]
+            if 'embeddings' in include:
+                rows = np.asarray([item[1] for item in ordered], dtype=np.int64)
+                result['embeddings'] = (np.asarray(self.exact[rows]) if self.dim and len(rows)
+                                        else np.empty((0, self.dim or 0), dtype=np.float32))
+        return result
+
+    def query(self, query_embeddings, n_results=10, include=DEFAULT_INCLUDE + ('distances',), rescore=VECTOR_RESCORE):
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        with self._lock:
+            rows = self.rows
+            valid = self.valid[:rows].copy()
+            vectors, exact, scales, norms = self.vectors, self.exact, self.scales, self.norms
+        k = min(n_results, int(valid.sum()))
+        if not k:
+            return self._query_result([[] for _ in queries], [[] for _ in queries], include)
+        if queries.shape[1] != self.dim:
+            raise ValueError(f'Query dimension {queries.shape[1]} does not match index dimension {self.dim}')
+
+        query_norms = np.einsum('ij,ij->i', queries, queries)
+        distances = np.empty((len(queries), rows), dtype=np.float32)
+        for start in range(0, rows, VECTOR_QUERY_BLOCK_ROWS):
+            end = min(start + VECTOR_QUERY_BLOCK_ROWS, rows)
+            dots = queries @ np.asarray(vectors[start:end], dtype=np.float32).T
+            if self.dtype == 'int8':
+                dots *= scales[start:end]
+            distances[:, start:end] = query_norms[:, None] + norms[start:end] - 2 * dots
+        distances[:, ~valid] = np.inf
+
+        candidates = min(k * VECTOR_RESCORE_FACTOR if rescore else k, int(valid.sum()))
+        candidate_rows = np.argpartition(distances, candidates - 1, axis=1)[:, :candidates]
+        if rescore:
+            unique_rows, inverse = np.unique(candidate_rows.ravel(), return_inverse=True)
+            diff = np.asarray(exact[unique_rows])[inverse.reshape(candidate_rows.shape)] - queries[:, None, :]
+            candidate_distances = np.einsum('ijk,ijk->ij', diff, diff)
+        else:
+            candidate_distances = np.maximum(np.take_along_axis(distances, candidate_rows, axis=1), 0)
+        order = np.argsort(candidate_distances, axis=1, kind='stable')[:, :k]
+        return self._query_result(np.take_along_axis(candidate_rows, order, axis=1).tolist(),
+                                  np.take_along_axis(candidate_distances, order, axis=1).tolist(), include)
+
+    def _query_result(self, rows, distances, include):
+        with self._lock:
+            hits = [[(self.row_ids[row], distance) for row, distance in zip(query_rows, query_distances)
+                     if self.row_ids[row] is not None]
+                    for query_rows, query_distances in zip(rows, distances)]
+            items = self._fetch({doc_id for query_hits in hits for doc_id, _ in query_hits})
+        hits = [[(doc_id, distance) for doc_id, distance in query_hits if doc_id in items] for query_hits in hits]
+        result = {'ids': [[doc_id for doc_id, _ in query_hits] for query_hits in hits], 'documents': None,
+                  'metadatas': None, 'embeddings': None, 'distances': None, 'included': list(include)}
+        if 'distances' in include:
+            result['distances'] = [[distance for _, distance in query_hits] for query_hits in hits]
+        if 'documents' in include:
+            result['documents'] = [[items[doc_id][1] for doc_id, _ in query_hits] for query_hits in hits]
+        if 'metadatas' in include:
+            result['metadatas'] = [[items[doc_id][2] for doc_id, _ in query_hits] for query_hits in hits]
+        return result